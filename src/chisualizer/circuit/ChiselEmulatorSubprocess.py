@@ -1,22 +1,22 @@
+from bisect import bisect_right
 import logging
+import Queue
 import subprocess
 import string
 import atexit
+import threading
+import time
 
 from Common import Circuit, CircuitNode, CircuitView, TemporalNode
-from ValueDictView import ValueDictView
+from EmulatorTransport import EmulatorReply, EmulatorTransport
+from HierarchyIndex import HierarchyIndex, MEMORY, WIRE
+from ValueDictView import ValueDictNode, ValueDictView
 
 def result_to_list(res):
   if not res:
     return []
   return string.split(res)
 
-def result_to_int(res):
-  try:
-    return int(res, 0)
-  except ValueError:
-    raise ValueError("Expected int, got '%s'" % res)
-
 def result_to_bool(res):
   if res == "true":
     return True
@@ -31,20 +31,210 @@ def result_ok(res):
   else:
     return False
 
+# Maximum number of wires peeked by one wire_peek_bulk command.
+BULK_PEEK_WIRES = 1024
+
+# Runs of at least this many cycles are clocked in the background (see
+# EmulatorRunner), so the UI stays responsive and can cancel them.
+BACKGROUND_RUN_CYCLES = 10000
+# Background runs are clocked in chunks sized to take about this long, which
+# bounds the wait for cancelling and for the UI's own requests.
+RUN_CHUNK_SECONDS = 0.05
+RUN_FIRST_CHUNK = 1000
+
+# Default number of emulator snapshots kept for the temporal nodes (see
+# EmulatorSnapshots).
+MAX_SNAPSHOTS = 256
+
+class EmulatorRunner(object):
+  """
+  Clocks an emulator for a number of cycles in a background thread, in chunks
+  of about RUN_CHUNK_SECONDS, checking for cancellation between them. The
+  cycles run so far are queued for the UI thread to pick up through
+  get_progress, and the transport is the only thing shared between the
+  threads.
+  """
+  def __init__(self, transport, cycles):
+    self.transport = transport
+    self.cycles = cycles
+    self.progress = Queue.Queue()
+    self.cancelled = threading.Event()
+    self.done = False
+    self.error_cycles_run = 0
+    self.thread = threading.Thread(target=self.run, name="Emulator runner")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self):
+    cycles_run = 0
+    chunk = RUN_FIRST_CHUNK
+    error = None
+    try:
+      while cycles_run < self.cycles and not self.cancelled.is_set():
+        chunk = min(chunk, self.cycles - cycles_run)
+        begin = time.time()
+        chunk_run = self.transport.command('clock', chunk)
+        elapsed = time.time() - begin
+        cycles_run += chunk_run
+        self.progress.put((cycles_run, False, None))
+        if chunk_run < chunk:
+          break  # the emulator stopped early
+        chunk = max(1, min(chunk * 4, int(chunk * RUN_CHUNK_SECONDS
+                                          / max(elapsed, 1e-6))))
+    except Exception as e:
+      error = e
+    finally:
+      # Always reported, or the UI would wait on the run forever.
+      self.progress.put((cycles_run, True, error))
+
+  def cancel(self):
+    """Stops the run after the chunk being clocked."""
+    self.cancelled.set()
+
+  def get_progress(self):
+    """Returns the number of cycles run so far, or None if there is no news
+    since the last call. Once the run finished, done is set. Errors are
+    raised here (with error_cycles_run set to the cycles run before)."""
+    cycles_run = None
+    while True:
+      try:
+        progress_cycles, done, error = self.progress.get_nowait()
+      except Queue.Empty:
+        break
+      cycles_run = progress_cycles
+      if done:
+        self.done = True
+        if error is not None:
+          self.error_cycles_run = cycles_run
+          raise error
+        break
+    return cycles_run
+
+class EmulatorSnapshots(object):
+  """
+  Tracks the temporal nodes whose state is saved as an emulator snapshot, and
+  releases snapshots once there are more than max_snapshots, keeping them
+  dense near the cursor (the current node) and sparser further away. A node
+  without its snapshot is rebuilt from the nearest older one by re-clocking
+  (see ChiselEmulatorSubprocess.restore_temporal_node), so the nodes which
+  can't be rebuilt that way (those with no prev_time, like modifications, and
+  those modified in place) and the cursor are never evicted.
+  """
+  def __init__(self, circuit, max_snapshots):
+    assert max_snapshots >= 2
+    self.circuit = circuit
+    self.max_snapshots = max_snapshots
+    self.nodes = set()  # nodes whose snapshot is saved
+    self.has_release = None  # whether the emulator can release snapshots
+    self.evicted_count = 0
+
+  def saved(self, node, cursor):
+    """Records that a node's snapshot was saved, evicting others if over
+    budget."""
+    node.snapshot_saved = True
+    if node in self.nodes:
+      return
+    self.nodes.add(node)
+    while len(self.nodes) > self.max_snapshots:
+      evicted_node = self.choose_eviction(cursor)
+      if evicted_node is None:
+        break
+      self.release(evicted_node)
+
+  def choose_eviction(self, cursor):
+    """Returns the node whose snapshot is cheapest to do without: the one
+    leaving the smallest gap between the neighbouring snapshots (in cycles to
+    re-clock), relative to its distance from the cursor. Snapshots end up
+    spaced about in proportion to their distance from the cursor."""
+    saved_nodes = sorted(self.nodes, key=lambda node: node.cycle)
+    evicted_node = None
+    evicted_score = None
+    for i, node in enumerate(saved_nodes):
+      if node is cursor or node.prev_time is None or node.modified:
+        continue
+      prev_cycle = saved_nodes[i-1].cycle if i > 0 else node.cycle
+      if i + 1 < len(saved_nodes):
+        next_cycle = saved_nodes[i+1].cycle
+      else:
+        next_cycle = node.cycle
+      score = (float(next_cycle - prev_cycle)
+               / (abs(node.cycle - cursor.cycle) + 1))
+      if evicted_score is None or score < evicted_score:
+        evicted_node = node
+        evicted_score = score
+    return evicted_node
+
+  def release(self, node):
+    """Releases a node's snapshot in the emulator. Emulators without
+    referenced_snapshot_release keep theirs, so only the first release waits
+    for its reply."""
+    self.nodes.discard(node)
+    node.snapshot_saved = False
+    self.evicted_count += 1
+    if self.has_release is None:
+      try:
+        self.circuit.command("referenced_snapshot_release", node.snapshot)
+        self.has_release = True
+      except ValueError:
+        logging.warn("Emulator can't release snapshots, its memory will grow with the history")
+        self.has_release = False
+    elif self.has_release:
+      self.circuit.request("referenced_snapshot_release", node.snapshot)
+
+  def clear(self):
+    """Releases all snapshots, as on reset, which drops the history."""
+    for node in list(self.nodes):
+      self.release(node)
+
 class ChiselEmulatorSubprocess(Circuit):
-  def __init__(self, emulator_path, reset=True):
-    """Starts the emulator subprocess."""
+  def __init__(self, emulator_path, reset=True, binary_framing=False,
+               max_snapshots=MAX_SNAPSHOTS, snapshot_budget_bytes=None):
+    """Starts the emulator subprocess. If binary_framing is set, replies are
+    switched to binary frames if the emulator supports them (see
+    EmulatorTransport). At most max_snapshots emulator snapshots are kept for
+    the temporal nodes, or if snapshot_budget_bytes is given, as many as fit
+    in it at the estimated size of the circuit state."""
     super(ChiselEmulatorSubprocess, self).__init__()
     
-    self.p = subprocess.Popen(emulator_path,
+    # Buffered, so replies aren't read a byte at a time (commands are flushed
+    # as they are sent).
+    self.p = subprocess.Popen(emulator_path, bufsize=-1,
                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                               stderr=subprocess.STDOUT)
     atexit.register(self.p.terminate)
+    self.transport = EmulatorTransport(self.p.stdin, self.p.stdout)
+    # map from peek command (op and args) to its EmulatorReply, valid until
+    # the circuit state changes
+    self.peek_replies = {}
+    # map from width or depth command to its EmulatorReply, valid forever
+    self.constant_replies = {}
 
     self.wires = result_to_list(self.command("list_wires"))
     self.mems =  result_to_list(self.command("list_mems"))
     logging.debug("Found wires: %s" % self.wires)
     logging.debug("Found mems: %s" % self.mems)
+    self.has_bulk_peek = self.probe_bulk_peek()
+    logging.debug("Bulk peek supported: %s" % self.has_bulk_peek)
+    if binary_framing:
+      logging.debug("Binary framing supported: %s"
+                    % self.transport.enable_binary_framing())
+    self.hierarchy = HierarchyIndex.from_nodes(self.wires)
+    for mem in self.mems:
+      self.hierarchy.add(mem, MEMORY)
+
+    # Wires captured in the value dicts of temporal nodes, those resolved
+    # through the historical view (see capture_wire).
+    self.captured_wires = []
+    self.captured_wire_set = set()
+    self.temporal_node = None
+    self.runner = None  # EmulatorRunner of the background run, if any
+    self.run_cycles = 0  # cycles to clock in the background run
+    self.run_cycles_done = 0  # cycles clocked so far by the background run
+    if snapshot_budget_bytes is not None:
+      max_snapshots = max(snapshot_budget_bytes
+                          // self.estimate_snapshot_bytes(), 2)
+    self.snapshots = EmulatorSnapshots(self, max_snapshots)
+    logging.debug("Keeping up to %i snapshots" % max_snapshots)
     
     if reset:
       self.reset(1)
@@ -54,25 +244,84 @@ class ChiselEmulatorSubprocess(Circuit):
     self.temporal_node = self.create_temporal_node(0)
 
   def command(self, op, *args):
-    """Sends a command to the emulator, and returns the output string."""
-    # sanity check - extra newlines will break the protocol
-    assert isinstance(op, basestring)
-    cmd = op
-    for arg in args:
-      cmd += ' ' + str(arg)
-    if cmd.find('\n') != -1:
-      raise ValueError("Command contains unexpected newline: '%s'" % cmd)
-        
-    self.p.stdin.write(cmd + '\n')
-    self.p.stdin.flush();
-    out = self.p.stdout.readline().strip()
-    if out.startswith('error'):
-      raise ValueError("Command '%s' returned error: '%s'" % (cmd, out))
-    logging.debug("API: '%s' -> '%s'", cmd, out)
-    return out;
+    """Sends a command to the emulator, and returns the output (see
+    EmulatorReply.get)."""
+    return self.transport.command(op, *args)
+
+  def request(self, op, *args):
+    """Sends a command to the emulator without waiting for its output,
+    returning an EmulatorReply. Requests are pipelined until an output is
+    needed."""
+    return self.transport.send(op, *args)
+
+  def request_peek(self, op, *args):
+    """Returns the EmulatorReply of a peek (wire_peek or mem_peek), shared by
+    all peeks of the same node until the circuit state changes."""
+    key = (op,) + args
+    reply = self.peek_replies.get(key)
+    if reply is None:
+      reply = self.peek_replies[key] = self.request(op, *args)
+    return reply
+
+  def request_constant(self, op, *args):
+    """Returns the EmulatorReply of a width or depth command, requested once
+    per node."""
+    key = (op,) + args
+    reply = self.constant_replies.get(key)
+    if reply is None:
+      reply = self.constant_replies[key] = self.request(op, *args)
+    return reply
+
+  def invalidate_peeks(self):
+    """Drops the cached peeks, on any change to the circuit state (clock,
+    reset, poke or snapshot restore)."""
+    self.peek_replies = {}
+
+  def probe_bulk_peek(self):
+    """Returns whether the emulator supports wire_peek_bulk, which peeks a
+    list of wires in one command (replying with their values, space
+    separated)."""
+    try:
+      self.command("wire_peek_bulk")
+    except ValueError:
+      return False
+    return True
+
+  def peek_wires(self, wires):
+    """Returns the list of values of a list of wires, with bulk peeks if
+    supported and otherwise pipelined single peeks. Only the wires not peeked
+    since the circuit state last changed are peeked."""
+    if self.has_bulk_peek:
+      missing = [wire for wire in wires
+                 if ('wire_peek', wire) not in self.peek_replies]
+      batches = [missing[begin:begin+BULK_PEEK_WIRES]
+                 for begin in xrange(0, len(missing), BULK_PEEK_WIRES)]
+      replies = [self.request('wire_peek_bulk', *batch) for batch in batches]
+      for batch, reply in zip(batches, replies):
+        batch_values = reply.get()
+        if len(batch_values) != len(batch):
+          raise ValueError("Expected %i values from wire_peek_bulk, got %i"
+                           % (len(batch), len(batch_values)))
+        for wire, value in zip(batch, batch_values):
+          self.peek_replies[('wire_peek', wire)] = EmulatorReply.resolved(
+              'wire_peek ' + wire, 'wire_peek', value)
+    replies = [self.request_peek('wire_peek', wire) for wire in wires]
+    return [reply.get() for reply in replies]
   
+  def estimate_snapshot_bytes(self):
+    """Returns the estimated size of a snapshot: the bytes of all wires and
+    memories."""
+    wire_widths = [self.request_constant('wire_width', wire)
+                   for wire in self.wires]
+    mem_sizes = [(self.request_constant('mem_width', mem),
+                  self.request_constant('mem_depth', mem))
+                 for mem in self.mems]
+    bits = sum(reply.get() for reply in wire_widths)
+    bits += sum(width.get() * depth.get() for width, depth in mem_sizes)
+    return max(bits // 8, 1)
+
   def has_node(self, node):
-    return node in self.wires or node in self.mems
+    return node in self.hierarchy
 
   def get_nodes_list(self):
     out = []
@@ -80,21 +329,69 @@ class ChiselEmulatorSubprocess(Circuit):
     out.extend(self.mems)
     return out
 
-  def create_temporal_node(self, cycle):
+  def create_temporal_node(self, cycle, prev_time=None):
+    """Creates a temporal node of the current state, clocked from prev_time
+    (linked in its timeline), or else starting a timeline."""
     self.temporal_nodes_count += 1
-    return ChiselTemporalNode(self.current_to_value_dict(),
+    node = ChiselTemporalNode(self.current_to_value_dict(),
                               self.temporal_nodes_count, 
                               cycle)
+    if prev_time is None:
+      ChiselTimeline(node)
+    else:
+      prev_time.timeline.insert(node)
+    return node
 
   def update_temporal_node(self):
-    self.snapshot_save(self.temporal_node.get_snapshot_state())
+    self.save_temporal_node(self.temporal_node, self.temporal_node)
     self.temporal_node.update(self.current_to_value_dict())
 
+  def save_temporal_node(self, node, cursor):
+    """Saves the current state as a node's snapshot, see EmulatorSnapshots."""
+    self.snapshot_save(node.get_snapshot_state())
+    self.snapshots.saved(node, cursor)
+
+  def restore_temporal_node(self, node):
+    """Restores the state of a node. If its snapshot was evicted, it is
+    rebuilt by clocking from the nearest older snapshot, saving snapshots of
+    the nodes passed at doubling distances back from it on the way, so
+    stepping further back is cheap too."""
+    if node.snapshot_saved:
+      self.snapshot_restore(node.get_snapshot_state())
+      return
+    evicted_nodes = []  # from the node back
+    base_node = node
+    while not base_node.snapshot_saved:
+      evicted_nodes.append(base_node)
+      base_node = base_node.get_prev_time()
+      assert base_node is not None, "temporal node can't be rebuilt"
+    logging.debug("Rebuilding cycle %i from the snapshot at cycle %i",
+                  node.cycle, base_node.cycle)
+    checkpoints = []
+    distance = 1
+    for evicted_node in evicted_nodes[1:]:
+      if node.cycle - evicted_node.cycle >= distance:
+        checkpoints.append(evicted_node)
+        distance *= 2
+    self.snapshot_restore(base_node.get_snapshot_state())
+    cycle = base_node.cycle
+    for checkpoint in reversed(checkpoints):
+      self.command("clock", checkpoint.cycle - cycle)
+      cycle = checkpoint.cycle
+      self.save_temporal_node(checkpoint, node)
+    self.command("clock", node.cycle - cycle)
+    self.invalidate_peeks()
+
   def get_current_temporal_node(self):
     return self.temporal_node
 
+  def get_hierarchy(self):
+    return self.hierarchy
+
   def do_modified_callback(self):
     # TODO: This can probably be made more efficient
+    # Its snapshot now holds the modification, which re-clocking wouldn't.
+    self.temporal_node.modified = True
     self.update_temporal_node()
     if self.temporal_node.get_next_time() is not None:
       prev_temporal_node = self.temporal_node
@@ -106,31 +403,47 @@ class ChiselEmulatorSubprocess(Circuit):
       prev_temporal_node.next_mod = self.temporal_node 
     super(ChiselEmulatorSubprocess, self).do_modified_callback()
     
+  def check_running(self):
+    """Returns whether a background run is in progress (warning that the
+    circuit can't be changed meanwhile)."""
+    if self.runner is not None:
+      logging.warn("Emulator is running, wait or cancel (Esc) first")
+      return True
+    return False
+
   def navigate_next_mod(self):
+    if self.check_running():
+      return
     if self.temporal_node.get_next_mod() is not None:
       self.update_temporal_node()
       self.temporal_node = self.temporal_node.get_next_mod()
-      self.snapshot_restore(self.temporal_node.get_snapshot_state())
+      self.restore_temporal_node(self.temporal_node)
     else:
       logging.warn("No next mod")
   
   def navigate_prev_mod(self):
+    if self.check_running():
+      return
     if self.temporal_node.get_prev_mod() is not None:
       self.update_temporal_node()
       self.temporal_node = self.temporal_node.get_prev_mod()
-      self.snapshot_restore(self.temporal_node.get_snapshot_state())
+      self.restore_temporal_node(self.temporal_node)
     else:
       logging.warn("No prev mod")
 
   def navigate_back(self):
+    if self.check_running():
+      return
     if self.temporal_node.get_prev_time() is not None:
       self.update_temporal_node()
       self.temporal_node = self.temporal_node.get_prev_time()
-      self.snapshot_restore(self.temporal_node.get_snapshot_state())
+      self.restore_temporal_node(self.temporal_node)
     else:
       logging.warn("No snapshots to revert")
 
   def navigate_fwd(self, cycles=None):
+    if self.check_running():
+      return
     if cycles is None:
       self.navigate_step()
     else:
@@ -142,64 +455,126 @@ class ChiselEmulatorSubprocess(Circuit):
       self.navigate_to_cycle(self.temporal_node.cycle + 1)
     else:
       self.temporal_node = self.temporal_node.get_next_time()
-      self.snapshot_restore(self.temporal_node.get_snapshot_state())
+      self.restore_temporal_node(self.temporal_node)
 
   def navigate_to_cycle(self, target_cycle):
+    """Navigates to the node at a cycle in the current timeline, clocking from
+    the nearest earlier node if there is none."""
     self.update_temporal_node()
-    curr_temporal_node = self.temporal_node
-    while True:
-      next_temporal_node = curr_temporal_node.get_next_time()
-      if next_temporal_node is None or next_temporal_node.cycle > target_cycle:
-        self.temporal_node = curr_temporal_node
-        self.snapshot_restore(self.temporal_node.get_snapshot_state())
-        self.clock(target_cycle - curr_temporal_node.cycle)
-        return
-      elif next_temporal_node.cycle == target_cycle:
-        self.temporal_node = next_temporal_node
-        self.snapshot_restore(self.temporal_node.get_snapshot_state())
-        return        
-      curr_temporal_node = next_temporal_node
+    curr_temporal_node = self.temporal_node.timeline.find(target_cycle)
+    if curr_temporal_node is None:
+      logging.warn("Cycle %i is before the start of this timeline", target_cycle)
+      curr_temporal_node = self.temporal_node.timeline.nodes[0]
+    self.temporal_node = curr_temporal_node
+    self.restore_temporal_node(self.temporal_node)
+    cycles = target_cycle - curr_temporal_node.cycle
+    if cycles >= BACKGROUND_RUN_CYCLES:
+      self.start_run(cycles)
+    elif cycles > 0:
+      self.clock(cycles)
       
   def reset(self, cycles):
+    if self.check_running():
+      return 0
+    self.snapshots.clear()
     self.temporal_nodes_count = 0
     self.temporal_node = self.create_temporal_node(0)
-    return result_to_int(self.command("reset", cycles))
+    cycles = self.command("reset", cycles)
+    self.invalidate_peeks()
+    return cycles
   
   def clock(self, cycles):
-    cycles = result_to_int(self.command("clock", cycles)) 
-    prev_temporal_node = self.temporal_node
-    self.temporal_node = self.create_temporal_node(self.temporal_node.cycle + cycles)
-    self.temporal_node.prev_time = prev_temporal_node
-    if prev_temporal_node.get_next_time() is not None:
-      assert prev_temporal_node.get_next_time().cycle > self.temporal_node.cycle
-      self.temporal_node.next_time = prev_temporal_node.next_time
-      prev_temporal_node.next_time.prev_time = self.temporal_node
-    prev_temporal_node.next_time = self.temporal_node
+    cycles = self.command("clock", cycles)
+    self.add_clocked_node(cycles)
     return cycles
 
+  def add_clocked_node(self, cycles):
+    """Links in a temporal node for the state after clocking the current one
+    for some cycles. Nothing is added if no cycles were run (the emulator
+    stopped), as the current node already holds that state."""
+    if not cycles:
+      return
+    self.invalidate_peeks()
+    self.temporal_node = self.create_temporal_node(
+        self.temporal_node.cycle + cycles, self.temporal_node)
+
+  def start_run(self, cycles):
+    """Clocks the emulator for some cycles in the background. poll() follows
+    the run, and adds its temporal node once it is done."""
+    logging.info("Running %i cycles in the background", cycles)
+    self.run_cycles = cycles
+    self.run_cycles_done = 0
+    self.invalidate_peeks()
+    self.runner = EmulatorRunner(self.transport, cycles)
+
+  def poll(self):
+    """Picks up the progress of a background run."""
+    if self.runner is None:
+      return
+    try:
+      cycles_run = self.runner.get_progress()
+    except Exception as e:
+      logging.error("Running the emulator failed: %s", e)
+      cycles_run = self.runner.error_cycles_run
+    if cycles_run is not None:
+      # The emulator state moved on, so cached peeks are stale.
+      self.invalidate_peeks()
+      self.run_cycles_done = cycles_run
+    if self.runner.done:
+      self.runner = None
+      logging.info("Ran %i cycles", self.run_cycles_done)
+      if self.run_cycles_done:
+        self.add_clocked_node(self.run_cycles_done)
+    super(ChiselEmulatorSubprocess, self).do_modified_callback()
+
+  def cancel(self):
+    if self.runner is not None:
+      logging.info("Cancelling the run")
+      self.runner.cancel()
+
+  def get_status_text(self):
+    if self.runner is not None:
+      return "running: %i of %i cycles, Esc to cancel" % (self.run_cycles_done,
+                                                          self.run_cycles)
+    return None
+
   def current_to_value_dict(self):
-    rtn = {}
-    for node_name in self.wires:
-      rtn[node_name] = result_to_int(self.command('wire_peek', node_name))
-    return rtn
+    return dict(zip(self.captured_wires,
+                    self.peek_wires(self.captured_wires)))
+
+  def capture_wire(self, path):
+    """Adds a wire to those captured in the value dicts of temporal nodes,
+    from the current node on. Paths which aren't wires are ignored."""
+    if (path in self.captured_wire_set
+        or self.hierarchy.get_kind(path) != WIRE):
+      return
+    self.captured_wires.append(path)
+    self.captured_wire_set.add(path)
+    if self.temporal_node is not None:
+      self.temporal_node.value_dict[path] = self.request_peek('wire_peek',
+                                                             path).get()
 
   def snapshot_save(self, name):
     self.command("referenced_snapshot_save", name)
   
   def snapshot_restore(self, name):
     self.command("referenced_snapshot_restore", name)
+    self.invalidate_peeks()
     
   def get_historical_view(self):
-    width_dict = {}
-    for node_name in self.wires:
-      width_dict[node_name] = result_to_int(self.command('wire_width', node_name))
-    return ValueDictView(self, width_dict)
+    return ChiselHistoricalView(self)
   
   def get_current_view(self):
     return ChiselCircuitView(self)
     
   def close(self):
-    self.command("quit")
+    if self.runner is not None:
+      self.runner.cancel()
+      self.runner.thread.join()
+      self.runner = None
+    # quit has no reply.
+    self.request("quit")
+    self.transport.flush()
 
 class ChiselCircuitView(CircuitView):
   def __init__(self, parent):
@@ -208,6 +583,36 @@ class ChiselCircuitView(CircuitView):
   def get_root_node(self):
     return ChiselNodePlaceholder(self.parent, "")
   
+class ChiselHistoricalView(ValueDictView):
+  """
+  View of the value dicts of temporal nodes. The wires resolved through it
+  (by the temporal visualizers, when instantiated) are those captured in
+  them, so the capture cost of a step follows what is shown rather than the
+  size of the design.
+  """
+  def __init__(self, api):
+    super(ChiselHistoricalView, self).__init__(api, {})
+    self.api = api
+
+  def get_root_node(self):
+    return ChiselHistoricalNode(self, "")
+
+class ChiselHistoricalNode(ValueDictNode):
+  def __init__(self, view, path):
+    super(ChiselHistoricalNode, self).__init__(view, path)
+    view.api.capture_wire(path)
+
+  def get_width(self):
+    return self.view.api.request_constant('wire_width', self.path).get()
+
+  def get_subscript_reference(self, subscript):
+    return ChiselHistoricalNode(self.view,
+                                self.path + "[" + str(subscript) + "]")
+
+  def get_child_reference(self, child_path):
+    return ChiselHistoricalNode(self.view,
+                                self.join_path(self.path, child_path))
+
 class ChiselNode(CircuitNode):
   def __str__(self):
     return "%s: %s" % (self.__class__.__name__, self.path)
@@ -218,13 +623,13 @@ class ChiselNode(CircuitNode):
     self.path = path
   
   def get_node_by_path(self, path):
-    if self.api.has_node(path):
-      if path in self.api.mems: # TODO more generalized solution
-        return ChiselMem(self.api, path)
-      else:
-        return ChiselWire(self.api, path)
-    else:
+    kind = self.api.get_hierarchy().get_kind(path)
+    if kind is None:
       return ChiselNodePlaceholder(self.api, path)
+    elif kind == MEMORY:
+      return ChiselMem(self.api, path)
+    else:
+      return ChiselWire(self.api, path)
 
   def get_child_reference(self, child_path):
     if not child_path:
@@ -247,7 +652,10 @@ class ChiselWire(ChiselNode):
     raise NotImplementedError("Node types not yet implemented")
 
   def get_width(self):
-    return result_to_int(self.api.command('wire_width', self.path))
+    return self.request_width().get()
+
+  def request_width(self):
+    return self.api.request_constant('wire_width', self.path)
   
   def get_depth(self):
     raise ValueError("Cannot get depth of wire")
@@ -259,11 +667,19 @@ class ChiselWire(ChiselNode):
     return True
 
   def get_value(self):
-    return result_to_int(self.api.command('wire_peek', self.path))
+    return self.request_value().get()
+
+  def request_value(self):
+    """Returns the EmulatorReply of a peek, to pipeline with other requests."""
+    return self.api.request_peek('wire_peek', self.path)
 
   def set_value(self, value):
-    rtn = (result_ok(self.api.command('wire_poke', self.path, value))
-           and result_ok(self.api.command('propagate')))
+    if self.api.check_running():
+      return False
+    poke = self.api.request('wire_poke', self.path, value)
+    propagate = self.api.request('propagate')
+    self.api.invalidate_peeks()
+    rtn = result_ok(poke.get()) and result_ok(propagate.get())
     self.api.do_modified_callback()
     return rtn
   
@@ -279,10 +695,13 @@ class ChiselMem(ChiselNode):
     raise NotImplementedError("Memory types not yet implemented")
 
   def get_width(self):
-    return result_to_int(self.api.command('mem_width', self.path))
+    return self.request_width().get()
+
+  def request_width(self):
+    return self.api.request_constant('mem_width', self.path)
   
   def get_depth(self):
-    return result_to_int(self.api.command('mem_depth', self.path))
+    return self.api.request_constant('mem_depth', self.path).get()
   
   def has_value(self):
     return False
@@ -314,6 +733,9 @@ class ChiselMemElement(ChiselNode):
 
   def get_width(self):
     return self.parent.get_width()
+
+  def request_width(self):
+    return self.parent.request_width()
   
   def get_depth(self):
     raise ValueError("Memory element has no depth")
@@ -325,23 +747,68 @@ class ChiselMemElement(ChiselNode):
     return True
 
   def get_value(self):
-    return result_to_int(self.api.command('mem_peek',
-                                          self.parent.path, self.element_num))
+    return self.request_value().get()
+
+  def request_value(self):
+    """Returns the EmulatorReply of a peek, to pipeline with other requests."""
+    return self.api.request_peek('mem_peek', self.parent.path,
+                                 self.element_num)
 
   def set_value(self, value):
-    rtn = (result_ok(self.api.command('mem_poke',
-                                      self.parent.path, self.element_num,
-                                      value))
-           and result_ok(self.api.command('propagate')))
+    if self.api.check_running():
+      return False
+    poke = self.api.request('mem_poke', self.parent.path, self.element_num,
+                            value)
+    propagate = self.api.request('propagate')
+    self.api.invalidate_peeks()
+    rtn = result_ok(poke.get()) and result_ok(propagate.get())
     self.api.do_modified_callback()
     return rtn
 
+class ChiselTimeline(object):
+  """
+  Temporal nodes linked in time: a first node (the reset state, or a
+  modification) and those clocked from it, as lists sorted by cycle, so the
+  node at or before a cycle is a binary search. Keeps the prev_time and
+  next_time links of its nodes.
+  """
+  def __init__(self, node):
+    self.cycles = [node.cycle]
+    self.nodes = [node]
+    node.timeline = self
+
+  def insert(self, node):
+    """Inserts a node, later than the first, linking it between its
+    neighbours."""
+    idx = bisect_right(self.cycles, node.cycle)
+    assert idx > 0 and self.cycles[idx-1] < node.cycle
+    prev_node = self.nodes[idx-1]
+    self.cycles.insert(idx, node.cycle)
+    self.nodes.insert(idx, node)
+    node.timeline = self
+    node.prev_time = prev_node
+    node.next_time = prev_node.next_time
+    if node.next_time is not None:
+      node.next_time.prev_time = node
+    prev_node.next_time = node
+
+  def find(self, cycle):
+    """Returns the last node at or before a cycle, or None if there is
+    none."""
+    idx = bisect_right(self.cycles, cycle) - 1
+    if idx < 0:
+      return None
+    return self.nodes[idx]
+
 class ChiselTemporalNode(TemporalNode):
   """A node associated with a particular state in time."""
   def __init__(self, value_dict, snapshot, cycle):
     self.update(value_dict)
     self.snapshot = snapshot
+    self.snapshot_saved = False  # see EmulatorSnapshots
+    self.modified = False  # whether modified in place, so can't be rebuilt
     self.cycle = cycle
+    self.timeline = None  # ChiselTimeline, which links prev_time and next_time
     self.prev_time = None
     self.next_time = None
     self.prev_mod = None
@@ -27,6 +27,10 @@ class Circuit(object):
     circuit state in the past."""
     raise NotImplementedError
   
+  def get_hierarchy(self):
+    """Returns the HierarchyIndex of the circuit's signal paths."""
+    raise NotImplementedError
+
   def navigate_next_mod(self):
     """Navigates to the next modification."""
     raise NotImplementedError
@@ -52,6 +56,22 @@ class Circuit(object):
     host, the host should terminate."""
     raise NotImplementedError
 
+  def cancel(self):
+    """Cancels a long running operation on the circuit (like a background
+    run), if any."""
+    pass
+
+  def poll(self):
+    """Checks for changes to the circuit from outside the UI (like a dump still
+    being written), calling the modified callbacks if there were any. Called
+    periodically from the UI thread."""
+    pass
+
+  def get_status_text(self):
+    """Returns a short description of outside activity on the circuit (like
+    loading progress) to show with the cycle, or None."""
+    return None
+
 class CircuitView(object):
   """
   Interface definition for a circuit view - provides access (read at least, 
@@ -0,0 +1,62 @@
+class CowDict(object):
+  """
+  Read-only dict made of a shared, flat base dict and a private dict of changes
+  on top of it, for chains of states which each differ from the previous by a
+  few entries. Deriving a new CowDict copies only the accumulated changes, and
+  folds them into a fresh base once that becomes cheaper. With d accumulated
+  changes, b base entries and k changes per derive, the base is rebuilt once
+  d > sqrt(2bk), giving an amortized cost of O(sqrt(bk)) instead of O(b).
+  """
+  def __init__(self, base, delta=None):
+    self.base = base
+    if delta is None:
+      delta = {}
+    self.delta = delta
+
+  def derive(self, changes):
+    """Returns a new CowDict with changes (a dict) applied on top of this."""
+    if not changes:
+      return self
+    delta = dict(self.delta)
+    delta.update(changes)
+    if len(delta) * len(delta) > 2 * len(self.base) * len(changes):
+      base = dict(self.base)
+      base.update(delta)
+      return CowDict(base)
+    return CowDict(self.base, delta)
+
+  def __getitem__(self, key):
+    delta = self.delta
+    if key in delta:
+      return delta[key]
+    return self.base[key]
+
+  def __contains__(self, key):
+    return key in self.delta or key in self.base
+
+  def get(self, key, default=None):
+    if key in self.delta:
+      return self.delta[key]
+    return self.base.get(key, default)
+
+  def private_len(self):
+    """Returns the number of entries not shared with the CowDict this was
+    derived from (counting a fresh base as private)."""
+    if self.delta:
+      return len(self.delta)
+    return len(self.base)
+
+  def flatten(self):
+    """Returns the contents as a new plain dict."""
+    flat = dict(self.base)
+    flat.update(self.delta)
+    return flat
+
+  def keys(self):
+    return self.flatten().keys()
+
+  def __iter__(self):
+    return iter(self.flatten())
+
+  def __len__(self):
+    return len(self.flatten())
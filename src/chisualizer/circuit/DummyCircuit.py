@@ -1,4 +1,5 @@
 from chisualizer.circuit.Common import *
+from chisualizer.circuit.HierarchyIndex import HierarchyIndex
 
 class DummyCircuit(Circuit):
   """
@@ -9,6 +10,9 @@ class DummyCircuit(Circuit):
     
   def get_nodes_list(self):
     return []
+
+  def get_hierarchy(self):
+    return HierarchyIndex()
   
   def reset(self, cycles):
     return 1
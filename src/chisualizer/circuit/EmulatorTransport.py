@@ -0,0 +1,237 @@
+import binascii
+from collections import deque
+import logging
+import struct
+import threading
+
+# Emulator API protocol: commands are text lines (op, then space separated
+# args), each answered by one reply, in order. Replies are text lines
+# ('error...' for errors), or once binary framing is enabled (the
+# binary_framing command, replying 'ok' as text), frames of:
+#   status and payload length (struct '<BI'), then the payload
+# The payload of wire_peek and mem_peek is the value as little-endian
+# unsigned bytes, that of wire_peek_bulk is each value as a byte count
+# (struct '<H') then its bytes, and that of other commands is the text reply.
+# Replies are decoded according to the command (see EmulatorReply.get).
+FRAME_HEADER = '<BI'
+FRAME_HEADER_BYTES = struct.calcsize(FRAME_HEADER)
+VALUE_COUNT_FORMAT = '<H'
+VALUE_COUNT_BYTES = struct.calcsize(VALUE_COUNT_FORMAT)
+FRAME_OK = 0
+FRAME_ERROR = 1
+
+# Commands replying with a value, and with a list of values.
+VALUE_OPS = frozenset(['wire_peek', 'mem_peek'])
+VALUES_OPS = frozenset(['wire_peek_bulk'])
+# Commands replying with an int as text, in either framing.
+INT_OPS = frozenset(['wire_width', 'mem_width', 'mem_depth', 'reset', 'clock'])
+
+# Budget of requests in flight (written, with their replies not yet read), in
+# estimated bytes of requests and replies. Replies not yet read must fit in
+# the pipe buffer (typically 64 KiB), or both processes block on writing.
+PIPELINE_BYTES = 32 * 1024
+# Estimated bytes of a reply (or of one value of a list), for the budget.
+REPLY_BYTES = 24
+
+def decode_uint(data):
+  """Decodes little-endian unsigned bytes."""
+  if not data:
+    return 0
+  return int(binascii.hexlify(data[::-1]), 16)
+
+def decode_uints(data):
+  """Decodes a list of values, each as a byte count then its bytes."""
+  values = []
+  pos = 0
+  while pos < len(data):
+    count, = struct.unpack_from(VALUE_COUNT_FORMAT, data, pos)
+    pos += VALUE_COUNT_BYTES
+    values.append(decode_uint(data[pos:pos+count]))
+    pos += count
+  return values
+
+def encode_uint(value):
+  """Encodes a non-negative value as little-endian unsigned bytes."""
+  if not value:
+    return ''
+  digits = '%x' % value
+  if len(digits) % 2:
+    digits = '0' + digits
+  return binascii.unhexlify(digits)[::-1]
+
+def encode_uints(values):
+  data = []
+  for value in values:
+    value_data = encode_uint(value)
+    data.append(struct.pack(VALUE_COUNT_FORMAT, len(value_data)))
+    data.append(value_data)
+  return ''.join(data)
+
+def parse_int(res):
+  try:
+    return int(res, 0)
+  except ValueError:
+    raise ValueError("Expected int, got '%s'" % res)
+
+class EmulatorReply(object):
+  """
+  Reply to a request sent through an EmulatorTransport, read (along with those
+  to earlier requests) when first needed.
+  """
+  __slots__ = ('transport', 'cmd', 'op', 'cost', 'received', 'result',
+               'error')
+
+  def __init__(self, transport, cmd, op, cost):
+    self.transport = transport
+    self.cmd = cmd
+    self.op = op
+    self.cost = cost  # estimated bytes, in the in flight budget
+    self.received = False
+    self.result = None
+    self.error = None
+
+  @classmethod
+  def resolved(cls, cmd, op, result):
+    """Returns a reply already holding its result, obtained otherwise."""
+    reply = cls(None, cmd, op, 0)
+    reply.received = True
+    reply.result = result
+    return reply
+
+  def get(self):
+    """Returns the result: an int for VALUE_OPS and INT_OPS, a list of ints
+    for VALUES_OPS, and the reply string otherwise. Raises ValueError on
+    errors."""
+    if self.transport is not None:
+      self.transport.receive_until(self)
+    if self.error is not None:
+      raise ValueError("Command '%s' returned error: '%s'"
+                       % (self.cmd, self.error))
+    return self.result
+
+class EmulatorTransport(object):
+  """
+  Client side of the emulator API protocol over a pair of pipes. Requests are
+  buffered and only written once a reply is needed (or the in flight budget
+  is used up), so any number can be in flight, and replies are matched to
+  requests by order.
+  Requests may be sent from several threads: whichever thread reads a reply
+  hands it to its request.
+  """
+  def __init__(self, to_emulator, from_emulator):
+    self.to_emulator = to_emulator
+    self.from_emulator = from_emulator
+    self.binary = False  # whether replies are framed
+    self.pending = deque()  # replies to requests in flight, oldest first
+    self.unsent = []  # request lines not yet written
+    self.in_flight_bytes = 0
+    self.sent_count = 0  # number of requests sent, for profiling
+    self.lock = threading.RLock()
+
+  def format_command(self, op, *args):
+    # sanity check - extra newlines will break the protocol
+    assert isinstance(op, basestring)
+    cmd = op
+    for arg in args:
+      cmd += ' ' + str(arg)
+    if cmd.find('\n') != -1:
+      raise ValueError("Command contains unexpected newline: '%s'" % cmd)
+    return cmd
+
+  def send(self, op, *args):
+    """Queues a request, returning its EmulatorReply."""
+    cmd = self.format_command(op, *args)
+    if op in VALUES_OPS:
+      cost = len(cmd) + REPLY_BYTES * len(args)
+    else:
+      cost = len(cmd) + REPLY_BYTES
+    with self.lock:
+      if self.pending and self.in_flight_bytes + cost > PIPELINE_BYTES:
+        # Receives down to half the budget, so requests are written in
+        # batches while the emulator works through those already written.
+        while self.pending and self.in_flight_bytes > PIPELINE_BYTES // 2:
+          self.receive()
+      reply = EmulatorReply(self, cmd, op, cost)
+      self.sent_count += 1
+      self.unsent.append(cmd + '\n')
+      self.pending.append(reply)
+      self.in_flight_bytes += cost
+    return reply
+
+  def command(self, op, *args):
+    """Sends a request and returns its result, see EmulatorReply.get."""
+    return self.send(op, *args).get()
+
+  def flush(self):
+    with self.lock:
+      if self.unsent:
+        self.to_emulator.write(''.join(self.unsent))
+        self.to_emulator.flush()
+        self.unsent = []
+
+  def receive(self):
+    """Reads the reply to the oldest request in flight. The reply is only
+    marked received once its result or error is set, so other threads can't
+    see it half done."""
+    self.flush()
+    reply = self.pending.popleft()
+    self.in_flight_bytes -= reply.cost
+    error = None
+    result = None
+    if self.binary:
+      header = self.from_emulator.read(FRAME_HEADER_BYTES)
+      if len(header) < FRAME_HEADER_BYTES:
+        raise IOError("Emulator closed its output")
+      status, length = struct.unpack(FRAME_HEADER, header)
+      out = self.from_emulator.read(length)
+      if status != FRAME_OK:
+        error = out
+    else:
+      line = self.from_emulator.readline()
+      if not line:
+        raise IOError("Emulator closed its output")
+      out = line.strip()
+      if out.startswith('error'):
+        error = out
+    if error is None:
+      try:
+        result = self.decode(reply.op, out)
+      except (ValueError, struct.error) as e:
+        error = str(e)
+    logging.debug("API: '%s' -> %r", reply.cmd, out)
+    reply.result = result
+    reply.error = error
+    reply.received = True
+
+  def decode(self, op, out):
+    """Returns the result of a reply to a command, see EmulatorReply.get."""
+    if op in INT_OPS:
+      return parse_int(out)
+    elif self.binary:
+      if op in VALUE_OPS:
+        return decode_uint(out)
+      elif op in VALUES_OPS:
+        return decode_uints(out)
+    else:
+      if op in VALUE_OPS:
+        return parse_int(out)
+      elif op in VALUES_OPS:
+        return [parse_int(res) for res in out.split()]
+    return out
+
+  def receive_until(self, reply):
+    """Reads replies until one to a request is received (possibly by another
+    thread)."""
+    with self.lock:
+      while not reply.received:
+        self.receive()
+
+  def enable_binary_framing(self):
+    """Switches replies to binary frames, if the emulator supports them.
+    Returns whether it does."""
+    assert not self.pending
+    try:
+      self.binary = self.command('binary_framing') == 'ok'
+    except ValueError:
+      self.binary = False
+    return self.binary
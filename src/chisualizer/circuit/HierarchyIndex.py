@@ -0,0 +1,98 @@
+# Kinds of indexed paths.
+WIRE = 'wire'
+MEMORY = 'memory'
+
+class HierarchyNode(object):
+  __slots__ = ('children', 'kind', 'depth')
+
+  def __init__(self):
+    self.children = {}  # map from path component to HierarchyNode
+    self.kind = None  # WIRE or MEMORY for signals, None for scopes only
+    self.depth = None  # of memories, if known
+
+class HierarchyIndex(object):
+  """
+  Trie of signal paths over their scope components (split on '.'), shared by
+  the circuit backends. Looking up a path costs O(its depth) regardless of the
+  number of signals, and the signals under a scope can be enumerated without
+  scanning the others. Memories are discovered from their element paths
+  (name[index]) as they are added.
+  """
+  def __init__(self):
+    self.root = HierarchyNode()
+
+  @classmethod
+  def from_nodes(cls, node_names, memory_depths={}):
+    """Returns the index of a collection of wire paths and a map from memory
+    path to depth."""
+    hierarchy = cls()
+    for node_name in node_names:
+      hierarchy.add(node_name)
+    for memory_name, depth in memory_depths.iteritems():
+      hierarchy.add(memory_name, MEMORY, depth)
+    return hierarchy
+
+  def find(self, path, create=False):
+    """Returns the HierarchyNode of a path, or None if there is none (unless
+    create is set)."""
+    node = self.root
+    if not path:
+      return node
+    for component in path.split('.'):
+      child = node.children.get(component)
+      if child is None:
+        if not create:
+          return None
+        child = node.children[component] = HierarchyNode()
+      node = child
+    return node
+
+  def add(self, path, kind=WIRE, depth=None):
+    node = self.find(path, create=True)
+    node.kind = kind
+    if depth is not None and (node.depth is None or depth > node.depth):
+      node.depth = depth
+
+  def add_memory_element(self, memory_path, index):
+    """Adds a memory element (like a VCD net memory[index]), growing the
+    depth of its memory to include it."""
+    self.add("%s[%i]" % (memory_path, index))
+    self.add(memory_path, MEMORY, index + 1)
+
+  def get_kind(self, path):
+    """Returns the kind of a signal path (WIRE or MEMORY), or None if it isn't
+    one."""
+    node = self.find(path)
+    if node is None:
+      return None
+    return node.kind
+
+  def __contains__(self, path):
+    return self.get_kind(path) is not None
+
+  def iter_paths(self, prefix=''):
+    """Yields (path, kind) of the signals at or below a scope path, in sorted
+    order."""
+    node = self.find(prefix)
+    if node is None:
+      return
+    stack = [(prefix, node)]
+    while stack:
+      path, node = stack.pop()
+      if node.kind is not None:
+        yield path, node.kind
+      for component in sorted(node.children, reverse=True):
+        if path:
+          child_path = path + '.' + component
+        else:
+          child_path = component
+        stack.append((child_path, node.children[component]))
+
+  def get_memory_depths(self, prefix=''):
+    """Returns the map from memory path to depth, for the memories at or below
+    a scope path."""
+    memory_depths = {}
+    for path, kind in self.iter_paths(prefix):
+      if kind == MEMORY:
+        memory_depths[path] = self.find(path).depth
+    return memory_depths
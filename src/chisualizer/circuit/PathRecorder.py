@@ -0,0 +1,43 @@
+from Common import CircuitNode, CircuitView
+
+class PathRecorderView(CircuitView):
+  """
+  Stand-in circuit view which records every node path resolved through it.
+  Instantiating a visualizer descriptor against this view collects the circuit
+  paths the descriptor references, without needing an actual circuit.
+  """
+  def __init__(self):
+    self.paths = set()
+
+  def get_root_node(self):
+    return PathRecorderNode(self, "")
+
+class PathRecorderNode(CircuitNode):
+  def __init__(self, view, path):
+    self.view = view
+    self.path = path
+    view.paths.add(path)
+
+  def get_type(self):
+    raise NotImplementedError("Node types not yet implemented")
+
+  def get_width(self):
+    return 1
+
+  def get_depth(self):
+    return 1
+
+  def has_value(self):
+    return True
+
+  def can_set_value(self):
+    return False
+
+  def get_value(self):
+    return 0
+
+  def get_subscript_reference(self, subscript):
+    return PathRecorderNode(self.view, self.path + "[" + str(subscript) + "]")
+
+  def get_child_reference(self, child_path):
+    return PathRecorderNode(self.view, self.join_path(self.path, child_path))
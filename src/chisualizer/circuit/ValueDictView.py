@@ -1,8 +1,32 @@
 from Common import CircuitNode, HistoricalCircuitView
 
+class MemoryContents(object):
+  """
+  Interface for the value of a memory in a value dict, for states which don't
+  hold its elements individually.
+  """
+  def has_element(self, address):
+    raise NotImplementedError
+
+  def read(self, address):
+    """Returns the value of an element."""
+    raise NotImplementedError
+
+def split_subscript(path):
+  """Returns the (base path, subscript) of a subscripted path like mem[3], or
+  (None, None)."""
+  if not path.endswith(']'):
+    return None, None
+  bracket_begin = path.rfind('[')
+  try:
+    return path[:bracket_begin], int(path[bracket_begin+1:-1])
+  except ValueError:
+    return None, None
+
 class ValueDictView(HistoricalCircuitView):
   """
-  View circuit state based on a value dict (from node paths to values
+  View circuit state based on a value dict (from node paths to values, or to
+  MemoryContents for memories whose elements aren't in it)
   """
   def __init__(self, circuit, width_dict, mem_depth_dict=None):
     self.value_dict = {}
@@ -19,6 +43,35 @@ class ValueDictView(HistoricalCircuitView):
   def get_current_temporal_node(self):
     return self.circuit.get_current_temporal_node()
 
+  def get_memory_element(self, path):
+    """Returns the (MemoryContents, address) holding a path, or (None, None)
+    if it isn't an element of one."""
+    memory_path, address = split_subscript(path)
+    if memory_path is None:
+      return None, None
+    contents = self.value_dict.get(memory_path)
+    if (not isinstance(contents, MemoryContents)
+        or not contents.has_element(address)):
+      return None, None
+    return contents, address
+
+  def has_value(self, path):
+    value = self.value_dict.get(path)
+    if value is not None:
+      return not isinstance(value, MemoryContents)
+    return self.get_memory_element(path)[0] is not None
+
+  def get_value(self, path):
+    value = self.value_dict.get(path)
+    if value is not None:
+      if isinstance(value, MemoryContents):
+        raise KeyError(path)
+      return value
+    contents, address = self.get_memory_element(path)
+    if contents is None:
+      raise KeyError(path)
+    return contents.read(address)
+
 class ValueDictNode(CircuitNode):
   def __init__(self, view, path):
     self.view = view
@@ -35,13 +88,13 @@ class ValueDictNode(CircuitNode):
     return self.view.mem_depth_dict[self.path]
 
   def has_value(self):
-    return self.path in self.view.value_dict
+    return self.view.has_value(self.path)
   
   def can_set_value(self):
     return False
 
   def get_value(self):
-    return self.view.value_dict[self.path]
+    return self.view.get_value(self.path)
   
   def get_subscript_reference(self, subscript):
     # TODO make this better
@@ -0,0 +1,153 @@
+from array import array
+from collections import namedtuple
+import cPickle as pickle
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+from VcdHistory import VcdHistory, TIME_TYPECODE
+
+# Parsed VCD, as needed to build a VcdCircuit:
+# histories: map from VCD code to VcdHistory, unscaled
+# nodes: map from node name to (VCD code or fused bundle key, size)
+# memory_depths: map from memory name to depth
+VcdTables = namedtuple('VcdTables', ['histories', 'nodes', 'memory_depths'])
+
+CACHE_SUFFIX = '.chcache'
+CACHE_MAGIC = 'CHVCDCACHE'
+CACHE_VERSION = 3
+
+# Amount of data at each end of the dump included in the content hash.
+HASH_SAMPLE_SIZE = 1024 * 1024
+
+# Typecode marking a values buffer stored as a pickled list (for signals too
+# wide for an array).
+LIST_TYPECODE = 'O'
+
+def cache_filename(vcd_filename):
+  return vcd_filename + CACHE_SUFFIX
+
+def vcd_file_key(vcd_filename):
+  """Returns a key identifying the contents of a dump: its size, mtime, and a
+  hash over its beginning and end (hashing multi-GB dumps in full would cost
+  about as much as parsing them)."""
+  stat = os.stat(vcd_filename)
+  digest = hashlib.sha1()
+  with open(vcd_filename, 'rb') as f:
+    digest.update(f.read(HASH_SAMPLE_SIZE))
+    if stat.st_size > HASH_SAMPLE_SIZE:
+      f.seek(max(HASH_SAMPLE_SIZE, stat.st_size - HASH_SAMPLE_SIZE))
+      digest.update(f.read(HASH_SAMPLE_SIZE))
+  return (stat.st_size, stat.st_mtime, digest.hexdigest())
+
+def signals_key(signals):
+  if signals is None:
+    return None
+  return sorted(signals)
+
+def load_vcd_cache(vcd_filename, signals=None):
+  """Returns the VcdTables stored in the dump's sidecar cache, or None if there
+  is no cache, it is stale, or it doesn't hold all the requested signals."""
+  filename = cache_filename(vcd_filename)
+  if not os.path.exists(filename):
+    return None
+  try:
+    with open(filename, 'rb') as f:
+      mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        return read_cache(mm, vcd_filename, signals)
+      finally:
+        mm.close()
+  except (IOError, OSError, ValueError, EOFError, struct.error,
+          pickle.UnpicklingError) as e:
+    logging.warn("Unable to read VCD cache '%s': %s", filename, e)
+    return None
+
+def read_cache(mm, vcd_filename, signals):
+  pos = len(CACHE_MAGIC)
+  if mm[:pos] != CACHE_MAGIC:
+    raise ValueError("not a VCD cache")
+  version, header_len = struct.unpack('<II', mm[pos:pos+8])
+  if version != CACHE_VERSION:
+    logging.info("VCD cache version %i outdated, reparsing", version)
+    return None
+  pos += 8
+  header = pickle.loads(mm[pos:pos+header_len])
+  data_begin = pos + header_len
+
+  if header['key'] != vcd_file_key(vcd_filename):
+    logging.info("VCD cache stale, reparsing")
+    return None
+  if header['signals'] is not None:
+    if signals is None or not set(signals).issubset(header['signals']):
+      logging.info("VCD cache missing requested signals, reparsing")
+      return None
+
+  time_typecode = header['time_typecode']
+  histories = {}
+  for vcd_key, (offset, count, values_typecode, values_len) in header['codes'].iteritems():
+    offset += data_begin
+    times = array(time_typecode)
+    times.fromstring(mm[offset:offset + count*times.itemsize])
+    offset += count*times.itemsize
+    if values_typecode == LIST_TYPECODE:
+      values = pickle.loads(mm[offset:offset + values_len])
+    else:
+      values = array(values_typecode)
+      values.fromstring(mm[offset:offset + values_len])
+    histories[vcd_key] = VcdHistory(times, values)
+
+  logging.info("Loaded VCD cache for '%s'", vcd_filename)
+  return VcdTables(histories, header['nodes'], header['memory_depths'])
+
+def save_vcd_cache(vcd_filename, signals, tables):
+  """Writes the sidecar cache for a dump. Failures (like a read-only directory)
+  are logged and otherwise ignored."""
+  filename = cache_filename(vcd_filename)
+  temp_filename = filename + '.tmp'
+
+  # Each history is stored as its raw times buffer, followed by its raw values
+  # buffer (or a pickled list of values for wide signals).
+  codes = {}
+  values_blobs = {}
+  offset = 0
+  for vcd_key, history in tables.histories.iteritems():
+    assert history.times.typecode == TIME_TYPECODE
+    if isinstance(history.values, array):
+      values_typecode = history.values.typecode
+      values_len = len(history.values) * history.values.itemsize
+    else:
+      values_typecode = LIST_TYPECODE
+      values_blobs[vcd_key] = pickle.dumps(history.values,
+                                           pickle.HIGHEST_PROTOCOL)
+      values_len = len(values_blobs[vcd_key])
+    count = len(history)
+    codes[vcd_key] = (offset, count, values_typecode, values_len)
+    offset += count*history.times.itemsize + values_len
+
+  header = pickle.dumps({
+    'key': vcd_file_key(vcd_filename),
+    'signals': signals_key(signals),
+    'time_typecode': TIME_TYPECODE,
+    'nodes': tables.nodes,
+    'memory_depths': tables.memory_depths,
+    'codes': codes,
+  }, pickle.HIGHEST_PROTOCOL)
+
+  try:
+    with open(temp_filename, 'wb') as f:
+      f.write(CACHE_MAGIC)
+      f.write(struct.pack('<II', CACHE_VERSION, len(header)))
+      f.write(header)
+      for vcd_key, history in tables.histories.iteritems():
+        f.write(history.times.tostring())
+        if vcd_key in values_blobs:
+          f.write(values_blobs[vcd_key])
+        else:
+          f.write(history.values.tostring())
+    os.rename(temp_filename, filename)
+    logging.info("Wrote VCD cache '%s'", filename)
+  except (IOError, OSError) as e:
+    logging.warn("Unable to write VCD cache '%s': %s", filename, e)
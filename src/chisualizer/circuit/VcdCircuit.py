@@ -1,174 +1,186 @@
-from collections import namedtuple
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict
 import logging
 
-from Verilog_VCD.Verilog_VCD import parse_vcd
+from CowDict import CowDict
+from HierarchyIndex import HierarchyIndex
+from VcdCache import VcdTables, load_vcd_cache, save_vcd_cache
+from VcdFollower import VcdBackgroundLoader, VcdFollower
+from VcdHistory import VcdHistory, TIME_TYPECODE
+from VcdMemory import VcdMemory, memory_key
+from VcdParser import is_compressed, parse_vcd
 
 from Common import Circuit, CircuitNode, CircuitView, TemporalNode
 from ValueDictView import ValueDictView
 
-VcdNode = namedtuple('VcdNode', ['vcd_key', 'tv_list', 'size'])
+VcdNode = namedtuple('VcdNode', ['vcd_key', 'history', 'size'])
 
-VcdBundle = namedtuple('VcdBundle', ['elements', 'size'])
-VcdBundleElem = namedtuple('VcdBundleElem', ['high', 'low', 'node'])
+# How the nets of a dump map to nodes:
+# nodes: map from node name to (VCD code, size)
+# bundles: map from node name to ([(low bit, width, VCD code), ...], size)
+# memory_depths: map from memory name to depth
+VcdLayout = namedtuple('VcdLayout', ['nodes', 'bundles', 'memory_depths'])
 
-VcdPosition = namedtuple('VcdPosition', ['node', 'bundle'])
+# Checkpointed (vcd_position, state) at a cycle, to seek from.
+VcdKeyframe = namedtuple('VcdKeyframe', ['cycle', 'vcd_position', 'state'])
 
-def vcd_val_to_int(vcd_val_str):
-  assert isinstance(vcd_val_str, basestring)
-  if vcd_val_str.find('x') >= 0:
-    vcd_val_str = vcd_val_str.replace('x', '0')
-  if vcd_val_str.find('z') >= 0:
-    vcd_val_str = vcd_val_str.replace('z', '0')
-    
-  try:
-    return int(vcd_val_str, 2)
-  except ValueError as e:
-    logging.error("Unable to decode VCD value '%s'" % vcd_val_str)
-    raise e
-
-def vcd_node_next(cycle, curr_idx, node):
-  while curr_idx < len(node.tv_list) - 1:
-    if node.tv_list[curr_idx+1][0] > cycle:
-      break
-    curr_idx += 1
-  assert curr_idx == len(node.tv_list) - 1 or node.tv_list[curr_idx+1][0] > cycle
-  return curr_idx, node.tv_list[curr_idx][1]
-
-def vcd_bundle_next(cycle, curr_idx, bundle):
-  combined_val = ""
-  new_idx = []
-  assert len(bundle.elements) == len(curr_idx)
-  for elem_idx, elem in zip(curr_idx, bundle.elements):
-    new_elem_idx, node_val = vcd_node_next(cycle, elem_idx, elem.node)
-    new_idx.append(new_elem_idx)
-    combined_val += node_val
-  return new_idx, combined_val
-
-def scale_tv_list(tv_list, timescale_divisor):
-  assert isinstance(timescale_divisor, int) and timescale_divisor >= 1
-  if timescale_divisor > 1:
-    new_tv_list = []
-    for tv_pair in tv_list:
-      assert len(tv_pair) == 2
-      new_tv_list.append((tv_pair[0]/timescale_divisor, tv_pair[1]))
-    return new_tv_list
-  else:
-    return tv_list
-
-class VcdCircuit(Circuit):
-  def __init__(self, vcd_filename, timescale_divisor=1, start_cycle=0):
-    super(VcdCircuit, self).__init__()
-    logging.info("Parsing VCD file '%s'..." % vcd_filename)
-    self.parsed_vcd = parse_vcd(vcd_filename)
-    logging.info("Done parsing '%s'" % vcd_filename)
-  
-    self.nodes = {}
-    working_bundles = {}
-    self.memory_depths = {} # TODO: refactor
-    
-    for vcd_key, nets_tv_dict in self.parsed_vcd.iteritems():
-      for net_dict in nets_tv_dict['nets']:
-        parsed_node = VcdNode(vcd_key=vcd_key,
-                              tv_list=scale_tv_list(nets_tv_dict['tv'],
-                                                    timescale_divisor),
-                              size=int(net_dict['size'], 10))
-        node_name = net_dict['hier'] + '.' + net_dict['name']
-        bracket_begin = node_name.rfind('[')
-        bracket_end = node_name.rfind(']')
-        if bracket_begin >= 0 and bracket_end >= 0 and bracket_begin < bracket_end:
-          # This deals with ModelSim VCDs which derp bundles into single bits.
-          node_name_stripped = node_name[:bracket_begin]
-          
-          index = node_name[bracket_begin+1:bracket_end]
-          delim = index.find(':')
-          # TODO more graceful error handling
-          if delim >= 0:
-            begin_str = index[:delim]
-            end_str = index[delim+1:]
-            begin = int(begin_str)
-            end = int(end_str)
-          else:
-            begin = end = int(index)
-          
-          if begin == end and parsed_node.size > 1:
-            # Special case for memory element "wires".
-            assert node_name not in self.nodes, "duplicate name: '%s': %s" % (node_name, net_dict)
-            self.memory_depths[node_name_stripped] = max(self.memory_depths.get(node_name_stripped, 1), begin+1)
-            self.nodes[node_name] = parsed_node
-          else:
-            if node_name_stripped not in working_bundles:
-              working_bundles[node_name_stripped] = {} # map high bit to VcdBundleElem
-            bundle = working_bundles[node_name_stripped]
-          
-            assert begin >= end
-            assert begin not in bundle
-          
-            bundle[begin] = VcdBundleElem(begin, end, parsed_node)
-        else:
-          assert node_name not in self.nodes, "duplicate name: '%s': %s" % (node_name, net_dict)
-          self.nodes[node_name] = parsed_node
+# Default number of cycles between keyframes.
+KEYFRAME_INTERVAL = 256
 
-    logging.info("%i nodes found", len(self.nodes))
-    logging.debug("Nodes found: %s", self.nodes.keys())
+# Default memory budget for the states held by temporal nodes.
+STATE_CACHE_BYTES = 256 * 1024 * 1024
+# Rough memory cost of a state or position dict entry, for budgeting.
+STATE_ENTRY_BYTES = 64
+
+def bundle_key(node_name):
+  """Returns the key of a fused bundle's history, which can't collide with a
+  VCD code (those are strings)."""
+  return ('bundle', node_name)
+
+def collect_changes(changes, vcd_key, times, prev_time):
+  """Adds the times a VCD code changes at (its entry times, other than those
+  repeating the previous) to a map from time to the list of codes changing
+  then."""
+  for time in times:
+    if time != prev_time:
+      changes.setdefault(time, []).append(vcd_key)
+      prev_time = time
+
+def build_vcd_tables(parsed_vcd):
+  """Sorts the nets of a parsed VCD (in the parse_vcd format) into nodes,
+  bundles and inferred memories, returning a VcdTables. Bundles are fused into
+  histories of their own, and become nodes like any other."""
+  layout = build_vcd_layout(dict(
+      (vcd_key, nets_history_dict['nets'])
+      for vcd_key, nets_history_dict in parsed_vcd.iteritems()))
+  histories, nodes = build_layout_histories(layout, dict(
+      (vcd_key, nets_history_dict['history'])
+      for vcd_key, nets_history_dict in parsed_vcd.iteritems()))
+  return VcdTables(histories, nodes, layout.memory_depths)
+
+def build_layout_histories(layout, histories):
+  """Returns the histories (from a map of VCD code to VcdHistory) needed by
+  the nodes of a VcdLayout, with bundles fused, and the map from node name to
+  (history key, size)."""
+  nodes = dict(layout.nodes)
+  node_histories = {}
+  for vcd_key, _ in layout.nodes.itervalues():
+    node_histories[vcd_key] = histories[vcd_key]
+  for node_name, (fields, size) in layout.bundles.iteritems():
+    fused_key = bundle_key(node_name)
+    node_histories[fused_key] = VcdHistory.fused(
+        [(low, width, histories[vcd_key]) for low, width, vcd_key in fields],
+        size + 1)
+    nodes[node_name] = (fused_key, size)
+  return node_histories, nodes
 
-    # Post-process bundles
-    self.bundles = {}
-    for node_name, bundle in working_bundles.iteritems():
-      largest = None
-      prev = 0
-      sorted_elems = []
-      for begin_idx, bundle_elem in reversed(sorted(bundle.items())):
-        assert begin_idx == bundle_elem.high
-        if largest is None:
-          largest = bundle_elem.high
+def build_vcd_layout(nets_by_code):
+  """Sorts the nets of a dump (a map from VCD code to the list of net dicts,
+  as in the parse_vcd format) into nodes, bundles and inferred memories,
+  returning a VcdLayout."""
+  nodes = {}
+  working_bundles = {}
+  memories = HierarchyIndex()
+  
+  for vcd_key, nets in nets_by_code.iteritems():
+    for net_dict in nets:
+      size = int(net_dict['size'], 10)
+      node_name = net_dict['hier'] + '.' + net_dict['name']
+      bracket_begin = node_name.rfind('[')
+      bracket_end = node_name.rfind(']')
+      if bracket_begin >= 0 and bracket_end >= 0 and bracket_begin < bracket_end:
+        # This deals with ModelSim VCDs which derp bundles into single bits.
+        node_name_stripped = node_name[:bracket_begin]
+        
+        index = node_name[bracket_begin+1:bracket_end]
+        delim = index.find(':')
+        # TODO more graceful error handling
+        if delim >= 0:
+          begin_str = index[:delim]
+          end_str = index[delim+1:]
+          begin = int(begin_str)
+          end = int(end_str)
+        else:
+          begin = end = int(index)
+        
+        if begin == end and size > 1:
+          # Special case for memory element "wires".
+          assert node_name not in nodes, "duplicate name: '%s': %s" % (node_name, net_dict)
+          memories.add_memory_element(node_name_stripped, begin)
+          nodes[node_name] = (vcd_key, size)
         else:
-          # Checks to ensure contiguous signals - currently parser can't fill in signals
-          assert bundle_elem.high == prev - 1, "prev %i, next high %i" % (prev, bundle_elem.high)
-        prev = bundle_elem.low 
-        sorted_elems.append(bundle_elem)
-      if not prev == 0:
-        logging.warn("Incomplete signal: %s (%i:%i), discarding", node_name, largest, prev)
+          if node_name_stripped not in working_bundles:
+            working_bundles[node_name_stripped] = {} # map high bit to bundle element
+          bundle = working_bundles[node_name_stripped]
+        
+          assert begin >= end
+          assert begin not in bundle
+        
+          bundle[begin] = (begin, end, vcd_key, size)
       else:
-        bundle = VcdBundle(sorted_elems, largest)
-        assert node_name not in self.bundles 
-        self.bundles[node_name] = bundle
-      
-    logging.info("%i bundles found", len(self.bundles))  
-    logging.debug("Bundles found: %s", self.bundles.keys())
-    
-    logging.info("%i memories inferred", len(self.memory_depths))
-    
+        assert node_name not in nodes, "duplicate name: '%s': %s" % (node_name, net_dict)
+        nodes[node_name] = (vcd_key, size)
+
+  # Post-process bundles
+  bundles = {}
+  for node_name, bundle in working_bundles.iteritems():
+    largest = None
+    prev = 0
+    sorted_elems = []
+    for begin_idx, bundle_elem in reversed(sorted(bundle.items())):
+      high, low, _, _ = bundle_elem
+      assert begin_idx == high
+      if largest is None:
+        largest = high
+      else:
+        # Checks to ensure contiguous signals - currently parser can't fill in signals
+        assert high == prev - 1, "prev %i, next high %i" % (prev, high)
+      prev = low 
+      sorted_elems.append(bundle_elem)
+    if not prev == 0:
+      logging.warn("Incomplete signal: %s (%i:%i), discarding", node_name, largest, prev)
+    else:
+      assert node_name not in nodes and node_name not in bundles
+      bundles[node_name] = ([(low, high - low + 1, vcd_key)
+                             for high, low, vcd_key, _ in sorted_elems],
+                            largest)
+  logging.info("%i bundles found", len(bundles))
+
+  return VcdLayout(nodes, bundles, memories.get_memory_depths())
+
+class VcdCircuitBase(Circuit):
+  """
+  Navigation and views shared by the circuits reading dumps, over the temporal
+  nodes made by create_temporal_node. Subclasses set width_dict,
+  memory_depths and hierarchy, then call init_views.
+  """
+  def init_views(self, start_cycle):
+    """Creates the node at the start cycle, and the views showing it."""
     self.initial_temporal_node = self.create_initial_temporal_node(start_cycle)
     self.current_temporal_node = self.initial_temporal_node
-
-    self.width_dict = {}
-    for node_name, vcd_node in self.nodes.iteritems():
-      self.width_dict[node_name] = vcd_node.size
-    for node_name, vcd_bundle in self.bundles.iteritems():
-      assert node_name not in self.width_dict
-      self.width_dict[node_name] = vcd_bundle.size
   
     self.current_view = ValueDictView(self, self.width_dict, self.memory_depths)
     self.historical_view = ValueDictView(self, self.width_dict, self.memory_depths)
     self.current_view.set_view(self.current_temporal_node.get_historical_state())
 
   def create_initial_temporal_node(self, cycle=0):
-    # TODO: refactor so they reference common data structure instead of two
-    # dicts (for efficiency reasons - constant term savings).
-    vcd_position = VcdPosition({}, {})
-    state = {}
-    for node_name, vcd_node in self.nodes.iteritems():
-      position, value = vcd_node_next(cycle, 0, vcd_node)
-      state[node_name] = vcd_val_to_int(value)
-      vcd_position.node[node_name] = position
-    for node_name, vcd_bundle in self.bundles.iteritems():
-      position, value = vcd_bundle_next(cycle, [0]*len(vcd_bundle.elements), vcd_bundle)
-      state[node_name] = vcd_val_to_int(value)
-      vcd_position.bundle[node_name] = position
-    return VcdTemporalNode(self, None, cycle, vcd_position, state)
+    return self.create_temporal_node(cycle)
+
+  def create_temporal_node(self, cycle, from_node=None):
+    """Creates an unlinked temporal node at an arbitrary cycle. from_node is
+    an earlier node whose state may be reused."""
+    raise NotImplementedError
+
+  def limit_fwd_cycles(self, cycles):
+    """Returns how many of some cycles forward can be navigated now."""
+    return cycles
 
   def get_current_temporal_node(self):
     return self.current_temporal_node
+
+  def get_hierarchy(self):
+    return self.hierarchy
       
   def get_current_view(self):
     return self.current_view
@@ -194,18 +206,431 @@ class VcdCircuit(Circuit):
   def navigate_fwd(self, cycles=None):
     if cycles is None:
       cycles = 1
-    if cycles == 1:
+    cycles = self.limit_fwd_cycles(cycles)
+    if cycles == 0:
+      pass
+    elif cycles == 1:
       self.current_temporal_node = self.current_temporal_node.get_next_time()
       assert self.current_temporal_node is not None
     else:
       target_cyc = self.current_temporal_node.cycle + cycles
-      self.current_temporal_node = self.create_initial_temporal_node(target_cyc)
+      self.current_temporal_node = self.create_temporal_node(
+          target_cyc, self.current_temporal_node)
     self.current_view.set_view(self.current_temporal_node.get_historical_state())
       
   def reset(self, cycles):
-    self.current_temporal_node = self.initial_temporal_nodel
+    self.current_temporal_node = self.initial_temporal_node
     self.current_view.set_view(self.current_temporal_node.get_historical_state())
 
+class VcdCircuit(VcdCircuitBase):
+  def __init__(self, vcd_filename, timescale_divisor=1, start_cycle=0,
+               signals=None, cache=True, keyframe_interval=KEYFRAME_INTERVAL,
+               state_cache_bytes=STATE_CACHE_BYTES, parse_processes=1,
+               follow=False, progressive=False):
+    """signals is an optional collection of node paths to load (for example,
+    those referenced by the visualizer descriptors), all other nets in the
+    dump are skipped during parsing.
+    If cache is set, the parsed tables are stored in (and on later opens,
+    loaded from) a sidecar file next to the dump.
+    keyframe_interval is the number of cycles between state checkpoints seeks
+    start from, trading memory for seek time, or 0 to seek by binary search
+    alone.
+    state_cache_bytes bounds the memory used by the states of visited cycles,
+    beyond which the least recently used are dropped (and regenerated from the
+    trace when next needed).
+    parse_processes is the number of processes large dumps are parsed with.
+    If follow is set, the dump is taken to still be written, and poll() picks
+    up the cycles appended to it (the cache isn't used then).
+    If progressive is set (and there is no cache to load), only the cycles up
+    to start_cycle are parsed before returning, the rest are parsed by a
+    background thread and picked up by poll() (without writing the cache).
+    Compressed dumps are read from the start rather than by file offset, so
+    they are parsed whole instead."""
+    super(VcdCircuit, self).__init__()
+    self.timescale_divisor = timescale_divisor
+    self.follow = follow
+    self.follower = None
+    self.loader = None
+    tables = None
+    if progressive and not follow and is_compressed(vcd_filename):
+      logging.warn("Can't load compressed VCD file '%s' progressively, parsing it whole",
+                   vcd_filename)
+      progressive = False
+    if cache and not follow:
+      tables = load_vcd_cache(vcd_filename, signals)
+    if tables is None and (follow or progressive):
+      self.follower = VcdFollower(vcd_filename, signals, timescale_divisor)
+      if progressive:
+        tables = self.load_followed(until_cycle=start_cycle, final=not follow)
+        self.loaded_cycle = self.follower.get_parsed_cycle()
+        self.loaded_percent = (self.follower.offset * 100
+                               // max(self.follower.size, 1))
+        self.loader = VcdBackgroundLoader(self.follower, final=not follow)
+      else:
+        tables = self.load_followed()
+    if tables is None:
+      logging.info("Parsing VCD file '%s'..." % vcd_filename)
+      tables = build_vcd_tables(parse_vcd(vcd_filename, siglist=signals,
+                                          processes=parse_processes))
+      logging.info("Done parsing '%s'" % vcd_filename)
+      if cache:
+        save_vcd_cache(vcd_filename, signals, tables)
+  
+    # Nets aliased to the same VCD code share one (scaled) history.
+    self.histories = histories = {}
+    for vcd_key, history in tables.histories.iteritems():
+      histories[vcd_key] = history.scaled(timescale_divisor)
+    
+    self.nodes = {}
+    for node_name, (vcd_key, size) in tables.nodes.iteritems():
+      self.nodes[node_name] = VcdNode(vcd_key, histories[vcd_key], size)
+
+    logging.info("%i nodes found", len(self.nodes))
+    logging.debug("Nodes found: %s", self.nodes.keys())
+
+    self.memory_depths = tables.memory_depths
+    logging.info("%i memories inferred", len(self.memory_depths))
+
+    self.width_dict = {}
+    for node_name, vcd_node in self.nodes.iteritems():
+      self.width_dict[node_name] = vcd_node.size
+    self.hierarchy = HierarchyIndex.from_nodes(self.width_dict,
+                                               self.memory_depths)
+    self.build_memories()
+    
+    self.build_change_index()
+    self.keyframe_interval = keyframe_interval
+    self.build_keyframes()
+    self.state_cache = VcdStateCache(state_cache_bytes)
+    
+    self.init_views(start_cycle)
+
+  def build_memories(self):
+    """Replaces the element nodes of each inferred memory with a node of the
+    whole memory, backed by a VcdMemory (a log of its element writes). States
+    then hold one entry per memory, whatever its depth, and stepping only
+    touches the memories written."""
+    # map from VCD code to [(memory key, address)] of the elements it drives,
+    # to route followed changes to
+    self.memory_elements = {}
+    for memory_name, depth in self.memory_depths.iteritems():
+      if memory_name in self.nodes:
+        continue  # shadowed by a wire of the same name
+      key = memory_key(memory_name)
+      elements = []
+      size = 0
+      for address in xrange(depth):
+        vcd_node = self.nodes.pop("%s[%i]" % (memory_name, address), None)
+        if vcd_node is None:
+          continue
+        elements.append((address, vcd_node.history))
+        size = max(size, vcd_node.size)
+        self.memory_elements.setdefault(vcd_node.vcd_key, []).append(
+            (key, address))
+      memory = VcdMemory.from_elements(size, elements)
+      self.histories[key] = memory
+      self.nodes[memory_name] = VcdNode(key, memory, size)
+    # Element histories only remain where other nodes share their codes.
+    node_keys = set(vcd_node.vcd_key for vcd_node in self.nodes.itervalues())
+    for vcd_key in self.histories.keys():
+      if vcd_key not in node_keys:
+        del self.histories[vcd_key]
+
+  def load_followed(self, until_cycle=None, final=False):
+    """Parses the dump written so far (or up to until_cycle) for follow or
+    progressive mode, returning a VcdTables. See VcdFollower.load."""
+    logging.info("Parsing VCD file '%s' incrementally..."
+                 % self.follower.filename)
+    parsed_vcd = self.follower.load(until_cycle, final=final)
+    self.follow_layout = build_vcd_layout(dict(
+        (vcd_key, nets_history_dict['nets'])
+        for vcd_key, nets_history_dict in parsed_vcd.iteritems()))
+    # Last values of all VCD codes, to fuse bundles with on later changes.
+    self.follow_values = dict(
+        (vcd_key, nets_history_dict['history'].values[-1])
+        for vcd_key, nets_history_dict in parsed_vcd.iteritems())
+    histories, nodes = build_layout_histories(self.follow_layout, dict(
+        (vcd_key, nets_history_dict['history'])
+        for vcd_key, nets_history_dict in parsed_vcd.iteritems()))
+    return VcdTables(histories, nodes, self.follow_layout.memory_depths)
+
+  def poll(self):
+    """Picks up the cycles parsed by the background loader in progressive
+    mode, or in follow mode, those appended to the dump."""
+    if self.loader is not None:
+      changes = self.poll_loader()
+      if changes is None and self.loader is not None:
+        return
+    elif self.follower is not None:
+      changes = self.follower.poll()
+      if not changes:
+        return
+    else:
+      return
+    if changes:
+      self.extend_histories(changes)
+      self.current_view.set_view(
+          self.current_temporal_node.get_historical_state())
+    self.do_modified_callback()
+
+  def poll_loader(self):
+    """Returns the changes parsed by the background loader since the last
+    poll (or None), updating the loading progress."""
+    try:
+      changes, cycle, offset = self.loader.get_changes()
+    except (IOError, ValueError) as e:
+      logging.error("Loading VCD file '%s' failed: %s",
+                    self.follower.filename, e)
+      changes = cycle = None
+    if cycle is not None:
+      self.loaded_cycle = cycle
+      self.loaded_percent = offset * 100 // max(self.follower.size, 1)
+    if self.loader.done:
+      logging.info("Done loading '%s'", self.follower.filename)
+      self.loader = None
+      if not self.follow:
+        self.follower = None
+    return changes
+
+  def get_status_text(self):
+    if self.loader is not None:
+      return "loading VCD: %i%%, to cycle %i" % (self.loaded_percent,
+                                                 self.loaded_cycle)
+    return None
+
+  def extend_histories(self, changes):
+    """Appends new changes (a map from VCD code to a VcdHistory of changes,
+    all later than those loaded) to the node histories and indices, and drops
+    the states they make stale."""
+    new_histories = {}
+    for vcd_key, history in changes.iteritems():
+      if vcd_key in self.histories:
+        new_histories[vcd_key] = history
+    for node_name, (fields, size) in self.follow_layout.bundles.iteritems():
+      if not any(vcd_key in changes for _, _, vcd_key in fields):
+        continue
+      field_histories = []
+      for low, width, vcd_key in fields:
+        # Starts from the last value, at a time before any new change.
+        field_history = VcdHistory(array(TIME_TYPECODE, [-1]),
+                                   [self.follow_values[vcd_key]])
+        if vcd_key in changes:
+          field_history.extend(changes[vcd_key])
+        field_histories.append((low, width, field_history))
+      fused = VcdHistory.fused(field_histories, size + 1)
+      new_histories[bundle_key(node_name)] = VcdHistory(fused.times[1:],
+                                                        fused.values[1:])
+    memory_writes = {}  # map from memory key to [(address, VcdHistory)]
+    for vcd_key, history in changes.iteritems():
+      self.follow_values[vcd_key] = history.values[-1]
+      for key, address in self.memory_elements.get(vcd_key, ()):
+        memory_writes.setdefault(key, []).append((address, history))
+
+    new_changes = {}
+    for vcd_key, new_history in new_histories.iteritems():
+      if not len(new_history):
+        continue
+      history = self.histories[vcd_key]
+      prev_time = history.times[-1]
+      new_history = new_history.scaled(self.timescale_divisor)
+      history.extend(new_history)
+      collect_changes(new_changes, vcd_key, new_history.times, prev_time)
+    for key, elements in memory_writes.iteritems():
+      memory = self.histories[key]
+      count = len(memory)
+      prev_time = memory.times[-1]
+      memory.extend_writes([(address, history.scaled(self.timescale_divisor))
+                            for address, history in elements])
+      collect_changes(new_changes, key, memory.times[count:], prev_time)
+    if not new_changes:
+      return
+    self.append_change_index(new_changes)
+    self.extend_keyframes()
+    self.state_cache.evict_from(min(new_changes))
+    logging.info("VCD extended to cycle %i", self.change_times[-1])
+
+  def build_change_index(self):
+    """Builds the global, time-ordered index of value changes (as the VCD
+    codes changing at each time) and the map from VCD codes to the nodes they
+    drive, so stepping only touches what changed."""
+    self.code_nodes = {}
+    for node_name, vcd_node in self.nodes.iteritems():
+      self.code_nodes.setdefault(vcd_node.vcd_key, []).append(node_name)
+    
+    changes = {}
+    for vcd_key, history in self.histories.iteritems():
+      times = history.times
+      if times:
+        # The first entry is the initial value, not a change. Later entries
+        # at the same (scaled) time are, as seeking reads the last of them.
+        collect_changes(changes, vcd_key, times[1:], None)
+    self.change_times = []
+    self.change_codes = []
+    # change_counts[i] is the number of changes before change_times[i].
+    self.change_counts = [0]
+    self.append_change_index(changes)
+    logging.info("%i change times indexed", len(self.change_times))
+
+  def append_change_index(self, changes):
+    """Appends changes (a map from time to the VCD codes changing then, all
+    later than those indexed) to the change index."""
+    for time in sorted(changes.iterkeys()):
+      assert not self.change_times or time > self.change_times[-1]
+      self.change_times.append(time)
+      self.change_codes.append(changes[time])
+      self.change_counts.append(self.change_counts[-1] + len(changes[time]))
+    
+  def get_changed_codes(self, from_cycle, to_cycle):
+    """Returns the VCD codes changing in cycles (from_cycle, to_cycle]. If
+    there are more changes in between than codes, returns all codes instead,
+    which is cheaper than collecting them."""
+    begin = bisect_right(self.change_times, from_cycle)
+    end = bisect_right(self.change_times, to_cycle)
+    if end - begin == 1:
+      return self.change_codes[begin]
+    if self.change_counts[end] - self.change_counts[begin] > len(self.histories):
+      return self.histories.iterkeys()
+    changed = set()
+    for change_codes in self.change_codes[begin:end]:
+      changed.update(change_codes)
+    return changed
+
+  def build_keyframes(self):
+    """Checkpoints the state every keyframe_interval cycles, from cycle 0 up to
+    the last change. Consecutive keyframes share most of their contents."""
+    self.keyframes = []
+    self.extend_keyframes()
+    logging.info("%i keyframes built", len(self.keyframes))
+
+  def extend_keyframes(self):
+    """Adds the keyframes missing up to the last change."""
+    if not self.keyframe_interval:
+      return
+    assert self.keyframe_interval > 0
+    if not self.keyframes:
+      self.keyframes.append(VcdKeyframe(0, *self.seek_temporal_state(0)))
+    keyframe = self.keyframes[-1]
+    last_cycle = self.change_times[-1] if self.change_times else 0
+    for cycle in xrange(keyframe.cycle + self.keyframe_interval, last_cycle + 1,
+                        self.keyframe_interval):
+      keyframe = VcdKeyframe(cycle, *self.advance_temporal_state(
+          keyframe.cycle, keyframe.vcd_position, keyframe.state, cycle))
+      self.keyframes.append(keyframe)
+
+  def get_keyframe(self, cycle):
+    """Returns the last keyframe at or before cycle, or None."""
+    if not self.keyframes or cycle < 0:
+      return None
+    idx = min(cycle // self.keyframe_interval, len(self.keyframes) - 1)
+    return self.keyframes[idx]
+
+  def create_temporal_node(self, cycle, from_node=None):
+    """Creates an unlinked temporal node at an arbitrary cycle, replaying the
+    changes since the nearest keyframe (or since from_node, if that is closer,
+    not after cycle and still has its state)."""
+    vcd_position, state = self.get_temporal_state(cycle, from_node)
+    return VcdTemporalNode(self, None, cycle, vcd_position, state)
+
+  def get_temporal_state(self, cycle, from_node=None):
+    """Returns the (vcd_position, state) at an arbitrary cycle, see
+    create_temporal_node."""
+    keyframe = self.get_keyframe(cycle)
+    if (from_node is not None and from_node.has_state()
+        and from_node.cycle <= cycle
+        and (keyframe is None or from_node.cycle >= keyframe.cycle)):
+      keyframe = VcdKeyframe(from_node.cycle, *from_node.get_temporal_state())
+    if keyframe is None:
+      return self.seek_temporal_state(cycle)
+    else:
+      return self.advance_temporal_state(
+          keyframe.cycle, keyframe.vcd_position, keyframe.state, cycle)
+
+  def seek_temporal_state(self, cycle):
+    """Returns the (vcd_position, state) at an arbitrary cycle, binary
+    searching each signal's history."""
+    vcd_position = {}
+    for vcd_key, history in self.histories.iteritems():
+      vcd_position[vcd_key] = history.seek(cycle)
+    state = {}
+    for node_name, vcd_node in self.nodes.iteritems():
+      state[node_name] = vcd_node.history.values[vcd_position[vcd_node.vcd_key]]
+    return CowDict(vcd_position), CowDict(state)
+
+  def advance_temporal_state(self, cycle, vcd_position, state, new_cycle):
+    """Returns the (vcd_position, state) at new_cycle derived from those at an
+    earlier cycle, only processing the changes in between."""
+    assert new_cycle >= cycle
+    position_changes = {}
+    state_changes = {}
+    for vcd_key in self.get_changed_codes(cycle, new_cycle):
+      history = self.histories[vcd_key]
+      times = history.times
+      idx = vcd_position[vcd_key]
+      if idx < len(times) - 1 and times[idx+1] <= new_cycle:
+        idx = bisect_right(times, new_cycle, idx + 1) - 1
+      position_changes[vcd_key] = idx
+      
+      value = history.values[idx]
+      for node_name in self.code_nodes[vcd_key]:
+        state_changes[node_name] = value
+    
+    return vcd_position.derive(position_changes), state.derive(state_changes)
+
+  def limit_fwd_cycles(self, cycles):
+    if (self.loader is not None
+        and self.current_temporal_node.cycle + cycles > self.loaded_cycle):
+      logging.warn("Only loaded up to cycle %i so far", self.loaded_cycle)
+      cycles = max(self.loaded_cycle - self.current_temporal_node.cycle, 0)
+    return cycles
+
+class VcdStateCache(object):
+  """
+  Tracks the temporal nodes holding their state, in least recently used order,
+  and drops the states of the least recently used once their estimated size is
+  over budget. Positions and states are CowDicts, so a node is only charged for
+  the entries it doesn't share with others, and a CowDict held by several
+  nodes (as after cycles with no changes) is charged once.
+  """
+  def __init__(self, budget_bytes):
+    self.budget_bytes = budget_bytes
+    self.nodes = OrderedDict()  # map from node to its CowDicts
+    # map from id of a CowDict held by nodes to [count of nodes, bytes]
+    self.holders = {}
+    self.total_bytes = 0
+
+  def touch(self, node):
+    """Marks a node (holding its state) as most recently used."""
+    cow_dicts = self.nodes.pop(node, None)
+    if cow_dicts is None:
+      cow_dicts = node.get_state_dicts()
+      for cow_dict in cow_dicts:
+        holder = self.holders.get(id(cow_dict))
+        if holder is None:
+          dict_bytes = STATE_ENTRY_BYTES * cow_dict.private_len()
+          self.holders[id(cow_dict)] = [1, dict_bytes]
+          self.total_bytes += dict_bytes
+        else:
+          holder[0] += 1
+    self.nodes[node] = cow_dicts
+    while self.total_bytes > self.budget_bytes and len(self.nodes) > 1:
+      evicted_node, cow_dicts = self.nodes.popitem(last=False)
+      self.release(evicted_node, cow_dicts)
+
+  def release(self, node, cow_dicts):
+    """Drops a node's state, uncharging the CowDicts no other node holds."""
+    for cow_dict in cow_dicts:
+      holder = self.holders[id(cow_dict)]
+      holder[0] -= 1
+      if not holder[0]:
+        del self.holders[id(cow_dict)]
+        self.total_bytes -= holder[1]
+    node.evict_state()
+
+  def evict_from(self, cycle):
+    """Drops the states of all nodes at or after a cycle."""
+    for node in [node for node in self.nodes if node.cycle >= cycle]:
+      self.release(node, self.nodes.pop(node))
+
 class VcdTemporalNode(TemporalNode):
   def __init__(self, circuit, prev_node, cycle, vcd_position, state):
     self.circuit = circuit
@@ -215,17 +640,42 @@ class VcdTemporalNode(TemporalNode):
     self.cycle = cycle
     self.vcd_position = vcd_position
     self.state = state
+    circuit.state_cache.touch(self)
   
+  def has_state(self):
+    return self.state is not None
+
+  def get_temporal_state(self):
+    """Returns this node's (vcd_position, state), regenerating them from the
+    trace if they were evicted."""
+    if self.state is None:
+      self.vcd_position, self.state = self.circuit.get_temporal_state(
+          self.cycle, self.prev_node)
+    self.circuit.state_cache.touch(self)
+    return self.vcd_position, self.state
+
+  def evict_state(self):
+    self.vcd_position = None
+    self.state = None
+
+  def get_state_dicts(self):
+    """Returns the CowDicts of the state held, for VcdStateCache."""
+    return (self.vcd_position, self.state)
+
   def get_historical_state(self):
-    return self.state
+    return self.get_temporal_state()[1]
   
   def get_snapshot_state(self):
-    return self.state
+    return self.get_temporal_state()[1]
   
   def get_label(self):
     return str(self.cycle)
   
   def get_prev_time(self):
+    if self.prev_node is None and self.cycle > 0:
+      # Nodes created by seeking have no history behind them, fill it in.
+      self.prev_node = self.circuit.create_temporal_node(self.cycle - 1)
+      self.prev_node.next_node = self
     return self.prev_node
 
   def get_next_time(self):
@@ -235,19 +685,9 @@ class VcdTemporalNode(TemporalNode):
 
   def generate_next_node(self):
     new_cycle = self.cycle + 1
-    
-    new_position = VcdPosition({}, {})
-    new_state = {}
-    
-    for node_name, vcd_node in self.circuit.nodes.iteritems():
-      position, value = vcd_node_next(new_cycle, self.vcd_position.node[node_name], vcd_node)
-      new_state[node_name] = vcd_val_to_int(value)
-      new_position.node[node_name] = position
-    for node_name, vcd_bundle in self.circuit.bundles.iteritems():
-      position, value = vcd_bundle_next(new_cycle, self.vcd_position.bundle[node_name], vcd_bundle)
-      new_state[node_name] = vcd_val_to_int(value)
-      new_position.bundle[node_name] = position
-
+    vcd_position, state = self.get_temporal_state()
+    new_position, new_state = self.circuit.advance_temporal_state(
+        self.cycle, vcd_position, state, new_cycle)
     return VcdTemporalNode(self.circuit, self, new_cycle, new_position, 
                            new_state)
 
@@ -0,0 +1,209 @@
+import argparse
+from functools import partial
+import gzip
+import logging
+import os
+
+from VcdParser import CHUNK_SIZE, VcdParser, find_body_begin, iter_vcd_chunks
+
+def path_has_prefix(path, prefix):
+  """Returns whether a net path is, or is below, a hierarchy prefix (like
+  'top.core' for 'top.core.pc' or 'top.core.regfile[3]')."""
+  return (path.startswith(prefix)
+          and (len(path) == len(prefix) or path[len(prefix)] in '.['))
+
+def split_hier(hier):
+  if not hier:
+    return []
+  return hier.split('.')
+
+def write_vcd_header(f, nets, timescale=None, comment=None):
+  """Writes the header of a dump declaring nets, a list of (VCD code, net
+  dict) as in the parse_vcd format."""
+  if comment is not None:
+    f.write("$comment %s $end\n" % comment)
+  if timescale is not None:
+    f.write("$timescale %s $end\n" % timescale)
+  scope = []
+  for code, net_dict in sorted(nets, key=lambda (code, net_dict): (
+      split_hier(net_dict['hier']), net_dict['name'])):
+    hier = split_hier(net_dict['hier'])
+    common = 0
+    while (common < len(scope) and common < len(hier)
+           and scope[common] == hier[common]):
+      common += 1
+    for _ in xrange(len(scope) - common):
+      f.write("$upscope $end\n")
+    for name in hier[common:]:
+      f.write("$scope module %s $end\n" % name)
+    scope = hier
+    f.write("$var %s %s %s %s $end\n" % (net_dict['type'], net_dict['size'],
+                                         code, net_dict['name']))
+  for _ in scope:
+    f.write("$upscope $end\n")
+  f.write("$enddefinitions $end\n")
+
+class VcdExtractWriter(object):
+  """
+  Value change sinks for a VcdParser (see VcdParser.resume), writing the
+  changes in a window of times to a dump. The values at the beginning of the
+  window are written as its $dumpvars, and changes before are only tracked
+  as the latest value of each code, so memory use doesn't depend on the
+  length of the input.
+  """
+  def __init__(self, f, sizes, begin_time, end_time):
+    """sizes is the map from VCD code to bit width of the codes to write."""
+    self.f = f
+    self.sizes = sizes
+    self.begin_time = begin_time
+    self.end_time = end_time
+    self.values = {}  # map from VCD code to value at begin_time
+    self.started = False  # whether the $dumpvars were written
+    self.time = None  # of the change being sent
+    self.written_time = None
+    self.lines = []  # not yet written
+    self.done = False  # whether a change past end_time was sent
+
+  def get_appenders(self):
+    return dict((code, (self.set_time, partial(self.add_value, code)))
+                for code in self.sizes)
+
+  def set_time(self, time):
+    self.time = time
+
+  def add_value(self, code, value):
+    time = self.time
+    if time <= self.begin_time:
+      self.values[code] = value
+    elif time > self.end_time:
+      self.done = True
+    else:
+      if not self.started:
+        self.start()
+      if time != self.written_time:
+        self.lines.append("#%i\n" % time)
+        self.written_time = time
+      self.lines.append(self.format_value(code, value))
+
+  def format_value(self, code, value):
+    # x and z bits were decoded to 0 by the parser.
+    if self.sizes[code] == 1:
+      return "%i%s\n" % (value, code)
+    return "b%s %s\n" % (bin(value)[2:], code)
+
+  def start(self):
+    self.lines.append("#%i\n$dumpvars\n" % self.begin_time)
+    for code in sorted(self.values):
+      self.lines.append(self.format_value(code, self.values[code]))
+    self.lines.append("$end\n")
+    self.values = None
+    self.started = True
+    self.written_time = self.begin_time
+
+  def flush(self):
+    self.f.write("".join(self.lines))
+    self.lines = []
+
+  def finish(self):
+    if not self.started:
+      self.start()
+    self.flush()
+
+def select_nets(data, prefixes=None):
+  """Returns the nets of a parsed header (VcdParser.data) under any of
+  prefixes (or all, if None), as a list of (VCD code, net dict), and the map
+  from their VCD codes to bit width."""
+  nets = []
+  sizes = {}
+  for code, code_dict in data.iteritems():
+    for net_dict in code_dict['nets']:
+      path = net_dict['hier'] + '.' + net_dict['name']
+      if prefixes is None or any(path_has_prefix(path, prefix)
+                                 for prefix in prefixes):
+        nets.append((code, net_dict))
+        sizes[code] = max(sizes.get(code, 0), int(net_dict['size'], 10))
+  if not nets:
+    raise ValueError("No matching signals were found in the VCD file")
+  return nets, sizes
+
+def extract_vcd(vcd_filename, filename, siglist=None, prefixes=None,
+                begin_cycle=0, end_cycle=None, timescale_divisor=1,
+                chunk_size=CHUNK_SIZE):
+  """Writes a dump holding the nets of a (possibly compressed) dump selected
+  by siglist (as in VcdParser) and under any of prefixes (if set), between
+  begin_cycle and end_cycle inclusive (post-scaling, None meaning the end).
+  Times are kept as they are, so cycles read the same in the extract. The
+  output is gzip compressed if filename ends in '.gz'. Returns the number of
+  nets written."""
+  begin_time = begin_cycle * timescale_divisor
+  if end_cycle is None:
+    end_time = float('inf')
+  else:
+    end_time = (end_cycle + 1) * timescale_divisor - 1
+  if filename.endswith('.gz'):
+    f = gzip.open(filename, 'wb')
+  else:
+    f = open(filename, 'wb')
+  logging.info("Extracting from VCD file '%s' to '%s'...",
+               vcd_filename, filename)
+  with f:
+    parser = VcdParser(siglist)
+    writer = None
+    for chunk in iter_vcd_chunks(vcd_filename, chunk_size):
+      if writer is None:
+        body_begin = find_body_begin(chunk)
+        if body_begin < 0:
+          parser.feed(chunk)
+          continue
+        parser.feed(chunk[:body_begin])
+        assert not parser.in_header
+        nets, sizes = select_nets(parser.data, prefixes)
+        write_vcd_header(f, nets, parser.timescale,
+                         "Extracted from %s, cycles %i to %s"
+                         % (os.path.basename(vcd_filename), begin_cycle,
+                            end_cycle if end_cycle is not None else "end"))
+        writer = VcdExtractWriter(f, sizes, begin_time, end_time)
+        parser.resume(parser.time, parser.in_comment, writer.get_appenders())
+        chunk = chunk[body_begin:]
+      parser.feed(chunk)
+      writer.flush()
+      if writer.done or parser.time > end_time:
+        break
+    if writer is None:
+      raise ValueError("VCD file '%s' has no $enddefinitions" % vcd_filename)
+    writer.finish()
+  logging.info("Wrote %i nets to '%s'", len(nets), filename)
+  return len(nets)
+
+def run_extractor():
+  parser = argparse.ArgumentParser(description="Extracts a window of cycles and subset of signals from a VCD")
+  parser.add_argument('vcd',
+                      help="VCD file to extract from (optionally .gz, .bz2 or .xz compressed).")
+  parser.add_argument('--output', '-o', required=True,
+                      help="VCD file to write (gzip compressed if it ends in .gz).")
+  parser.add_argument('--begin_cycle', type=int, default=0,
+                      help="First cycle to extract (post-scaling).")
+  parser.add_argument('--end_cycle', type=int,
+                      help="Last cycle to extract (post-scaling, defaults to the end).")
+  parser.add_argument('--vcd_timescale', type=int, default=1,
+                      help="Divide all VCD times by this amount to get cycles.")
+  parser.add_argument('--prefix', nargs='*',
+                      help="Only extract signals under these hierarchy paths.")
+  parser.add_argument('--visualizer_desc', '-d',
+                      help="Only extract signals referenced by this visualizer descriptor.")
+  args = parser.parse_args()
+  logging.getLogger().setLevel(logging.INFO)
+
+  signals = None
+  if args.visualizer_desc:
+    # The descriptor machinery needs wx, which extracting otherwise doesn't.
+    from chisualizer.descriptor.YamlDescriptor import YamlDescriptor
+    from chisualizer.ui.Manager import get_referenced_paths
+    vis_descriptor = YamlDescriptor()
+    vis_descriptor.read_descriptor(os.path.join(os.path.dirname(__file__),
+                                                '..', 'vislib.yaml'))
+    vis_descriptor.read_descriptor(args.visualizer_desc)
+    signals = get_referenced_paths(vis_descriptor)
+    logging.info("Descriptor references %i paths", len(signals))
+  extract_vcd(args.vcd, args.output, signals, args.prefix, args.begin_cycle,
+              args.end_cycle, args.vcd_timescale)
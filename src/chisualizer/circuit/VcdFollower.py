@@ -0,0 +1,221 @@
+from array import array
+import logging
+import os
+import Queue
+import threading
+
+from VcdHistory import VcdHistory, TIME_TYPECODE, create_values_buffer
+from VcdParser import VcdParser, find_body_begin, is_compressed
+
+# Size of the blocks dumps are parsed in incrementally, small enough for the
+# first cycles to show (and loading progress to update) quickly.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+def iter_time_line_starts(data):
+  """Yields the offsets of the '#time' lines in a block of value change lines,
+  last first."""
+  end = len(data)
+  while True:
+    newline = data.rfind('\n#', 0, end)
+    if newline < 0:
+      break
+    yield newline + 1
+    end = newline
+  if data.startswith('#'):
+    yield 0
+
+def find_complete_cycles_end(data, timescale_divisor=1):
+  """Returns the length of the prefix of a block of value change lines which
+  only holds complete cycles: up to the first '#time' line of the last cycle
+  started in it, which more changes may still be written to."""
+  end = 0
+  last_cycle = None
+  for start in iter_time_line_starts(data):
+    line_end = data.find('\n', start)
+    cycle = int(data[start+1:line_end].split()[0]) // timescale_divisor
+    if last_cycle is not None and cycle != last_cycle:
+      break
+    end = start
+    last_cycle = cycle
+  return end
+
+class VcdFollower(object):
+  """
+  Incrementally parses a dump still being written. Each poll parses the data
+  appended since the last, up to its last complete cycle (see
+  find_complete_cycles_end), so that later polls only ever add changes at
+  later cycles.
+  """
+  def __init__(self, filename, siglist=None, timescale_divisor=1):
+    if is_compressed(filename):
+      raise ValueError("Can't follow compressed VCD file '%s'" % filename)
+    self.filename = filename
+    self.timescale_divisor = timescale_divisor
+    self.parser = VcdParser(siglist)
+    self.offset = 0  # of the data not yet parsed
+    self.size = 0  # of the file, when last read
+    self.sizes = {}  # map from VCD code to size, once the header is parsed
+
+  def read_appended(self, max_bytes=None, final=False):
+    """Returns the complete lines appended since the last parsed data (about
+    max_bytes of them at most, if set), or with final set, the data up to the
+    end of the file if that is reached, last line complete or not."""
+    size = os.path.getsize(self.filename)
+    if size < self.offset:
+      logging.warn("VCD file '%s' shrank, ignoring it", self.filename)
+      return ''
+    self.size = size
+    if size == self.offset:
+      return ''
+    if max_bytes is not None:
+      size = min(size, self.offset + max_bytes)
+    with open(self.filename, 'rb') as f:
+      f.seek(self.offset)
+      data = f.read(size - self.offset)
+    if final and self.offset + len(data) == self.size:
+      return data
+    return data[:data.rfind('\n') + 1]
+
+  def feed_appended(self, data, final=False):
+    """Parses appended data up to the end of the header, or its last complete
+    cycle (or all of it, if final is set), returning whether any value changes
+    were parsed."""
+    if self.parser.in_header:
+      body_begin = find_body_begin(data)
+      if body_begin < 0:
+        self.parser.feed(data)
+        self.offset += len(data)
+        return False
+      self.parser.feed(data[:body_begin])
+      self.offset += body_begin
+      data = data[body_begin:]
+    if final:
+      end = len(data)
+    else:
+      end = find_complete_cycles_end(data, self.timescale_divisor)
+    if end == 0:
+      return False
+    self.parser.feed(data[:end])
+    self.offset += end
+    return True
+
+  def parse_appended(self, max_bytes=None, final=False):
+    """Parses the data appended since the last parsed, as feed_appended, about
+    max_bytes of it if set (more if a cycle doesn't fit). Returns whether any
+    data was parsed."""
+    while True:
+      offset = self.offset
+      data = self.read_appended(max_bytes, final)
+      if not data:
+        return False
+      self.feed_appended(data, final and offset + len(data) == self.size)
+      if self.offset != offset:
+        return True
+      if max_bytes is None or offset + len(data) == self.size:
+        return False
+      max_bytes *= 2
+
+  def get_parsed_cycle(self):
+    """Returns the last (complete) cycle parsed."""
+    return self.parser.time // self.timescale_divisor
+
+  def load(self, until_cycle=None, chunk_size=CHUNK_SIZE, final=False):
+    """Parses the dump written so far, or if until_cycle is set, only up to
+    that cycle (in chunks of about chunk_size), returning it in the parse_vcd
+    format. Signals without a value yet read as 0. If final is set, the dump
+    is complete, and the last cycle is parsed once its end is reached."""
+    if until_cycle is None:
+      self.parse_appended(final=final)
+    else:
+      while (self.parse_appended(chunk_size, final)
+             and (self.parser.in_header
+                  or self.get_parsed_cycle() < until_cycle)):
+        pass
+    if self.parser.in_header:
+      raise ValueError("VCD file '%s' has no $enddefinitions (yet)"
+                       % self.filename)
+    result = {}
+    for code, code_dict in self.parser.get_result().iteritems():
+      history = code_dict.pop('history')
+      result[code] = {'nets': code_dict['nets'], 'history': history}
+      self.sizes[code] = max(int(net_dict['size'], 10)
+                             for net_dict in code_dict['nets'])
+    self.parser.histories = {}
+    return result
+
+  def poll(self, max_bytes=None, final=False):
+    """Parses the complete cycles appended since the last poll (see
+    parse_appended), returning a map from VCD code to a VcdHistory of its new
+    changes (for the codes which changed), or None if nothing was parsed."""
+    histories = {}
+    appenders = {}
+    for code, size in self.sizes.iteritems():
+      history = VcdHistory(array(TIME_TYPECODE), create_values_buffer(size))
+      histories[code] = history
+      appenders[code] = (history.times.append, history.values.append)
+    self.parser.resume(self.parser.time, self.parser.in_comment, appenders)
+    if not self.parse_appended(max_bytes, final):
+      return None
+    return dict((code, history) for code, history in histories.iteritems()
+                if len(history))
+
+class VcdBackgroundLoader(object):
+  """
+  Parses the rest of a dump (after VcdFollower.load) in a background thread,
+  in chunks of about chunk_size. The changes of each chunk are queued for the
+  UI thread to pick up through get_changes, so nothing is shared between the
+  threads but the queue.
+  """
+  def __init__(self, follower, final=True, chunk_size=CHUNK_SIZE):
+    """If final is set, the dump is complete, and its last cycle is parsed
+    once the end is reached. Otherwise loading stops at the end of the dump
+    written so far, and the follower can take over from there."""
+    self.follower = follower
+    self.final = final
+    self.chunk_size = chunk_size
+    self.changes = Queue.Queue()
+    self.done = False
+    self.thread = threading.Thread(target=self.run, name="VCD loader")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self):
+    try:
+      while True:
+        changes = self.follower.poll(self.chunk_size, self.final)
+        if changes is None:
+          break
+        self.changes.put((changes, self.follower.get_parsed_cycle(),
+                          self.follower.offset, None))
+      self.changes.put((None, None, None, None))
+    except (IOError, ValueError) as e:
+      self.changes.put((None, None, None, e))
+
+  def get_changes(self):
+    """Returns the changes parsed since the last call, merged like
+    VcdFollower.poll results, the last cycle parsed and the file offset
+    reached, or (None, None, None) if there are none. Once loading finished,
+    done is set. Parse errors are raised here."""
+    merged = None
+    cycle = offset = None
+    while True:
+      try:
+        changes, changes_cycle, changes_offset, error = self.changes.get_nowait()
+      except Queue.Empty:
+        break
+      if error is not None:
+        self.done = True
+        raise error
+      if changes is None:
+        self.done = True
+        break
+      cycle, offset = changes_cycle, changes_offset
+      if merged is None:
+        merged = changes
+        continue
+      for code, history in changes.iteritems():
+        if code in merged:
+          merged[code].extend(history)
+        else:
+          merged[code] = history
+    return merged, cycle, offset
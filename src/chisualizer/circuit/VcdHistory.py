@@ -0,0 +1,119 @@
+from array import array
+from bisect import bisect_right
+import heapq
+from itertools import islice, izip, repeat
+import logging
+
+# Buffer typecodes. Python 2 arrays have no explicit 64-bit typecode, so this
+# relies on long being 64 bits (falling back to doubles for times otherwise).
+TIME_TYPECODE = 'l' if array('l').itemsize >= 8 else 'd'
+# Values are stored signed so they read back as ints rather than longs, which
+# leaves one bit less per element for unsigned values.
+VALUE_TYPECODE = 'l'
+VALUE_TYPECODE_BITS = array(VALUE_TYPECODE).itemsize * 8 - 1
+
+def vcd_val_to_int(vcd_val_str):
+  assert isinstance(vcd_val_str, basestring)
+  if vcd_val_str.find('x') >= 0:
+    vcd_val_str = vcd_val_str.replace('x', '0')
+  if vcd_val_str.find('z') >= 0:
+    vcd_val_str = vcd_val_str.replace('z', '0')
+
+  try:
+    return int(vcd_val_str, 2)
+  except ValueError as e:
+    logging.error("Unable to decode VCD value '%s'" % vcd_val_str)
+    raise e
+
+def create_values_buffer(size, values=()):
+  """Returns a buffer for integer values of some bit width: an array where the
+  values fit in its elements, otherwise a list of Python ints."""
+  if size <= VALUE_TYPECODE_BITS:
+    return array(VALUE_TYPECODE, values)
+  else:
+    return list(values)
+
+class VcdHistory(object):
+  """
+  Columnar value history of one VCD code: parallel buffers of change times
+  (sorted) and decoded integer values. Nets aliased to the same code share a
+  single history.
+  """
+  __slots__ = ('times', 'values')
+
+  def __init__(self, times, values):
+    assert len(times) == len(values)
+    self.times = times
+    self.values = values
+
+  @classmethod
+  def from_tv_list(cls, tv_list, size):
+    """Creates a history from a list of (time, VCD value string) tuples."""
+    return cls(array(TIME_TYPECODE, (time for time, _ in tv_list)),
+               create_values_buffer(size,
+                                    (vcd_val_to_int(value) for _, value in tv_list)))
+
+  @classmethod
+  def fused(cls, fields, size):
+    """Creates the history of a bundle from the histories of its bit fields,
+    given as a list of (low bit, width, VcdHistory). Field changes are merged
+    in time order, with each field's value shifted into place, so reading the
+    bundle later is a single lookup. Like seeking, each field is taken to hold
+    its first value until it first changes."""
+    fields = [field for field in fields if len(field[2])]
+    times = array(TIME_TYPECODE)
+    values = create_values_buffer(size)
+    if not fields:
+      return cls(times, values)
+
+    masks = []
+    value = 0
+    for low, width, history in fields:
+      masks.append(~(((1 << width) - 1) << low))
+      value |= history.values[0] << low
+    times.append(min(history.times[0] for _, _, history in fields))
+    values.append(value)
+
+    changes = heapq.merge(*[izip(islice(history.times, 1, None), repeat(idx),
+                                 islice(history.values, 1, None))
+                            for idx, (_, _, history) in enumerate(fields)])
+    for time, idx, field_value in changes:
+      value = (value & masks[idx]) | (field_value << fields[idx][0])
+      if time == times[-1]:
+        values[-1] = value
+      elif value != values[-1]:
+        times.append(time)
+        values.append(value)
+    return cls(times, values)
+
+  def __len__(self):
+    return len(self.times)
+
+  def extend(self, other):
+    """Appends the entries of another history, all later than these."""
+    assert not len(self) or not len(other) or other.times[0] >= self.times[-1]
+    self.times.extend(other.times)
+    self.values.extend(other.values)
+
+  def __eq__(self, other):
+    return (isinstance(other, VcdHistory)
+            and list(self.times) == list(other.times)
+            and list(self.values) == list(other.values))
+
+  def __ne__(self, other):
+    return not self == other
+
+  def seek(self, cycle):
+    """Returns the position in effect at an arbitrary cycle, in O(log changes).
+    Cycles before the first change map to the first position."""
+    return max(bisect_right(self.times, cycle) - 1, 0)
+
+  def scaled(self, timescale_divisor):
+    """Returns this history with times divided by timescale_divisor, sharing
+    the values buffer."""
+    assert isinstance(timescale_divisor, int) and timescale_divisor >= 1
+    if timescale_divisor == 1:
+      return self
+    return VcdHistory(array(self.times.typecode,
+                            (time // timescale_divisor for time in self.times)),
+                      self.values)
@@ -0,0 +1,121 @@
+from array import array
+from bisect import bisect_right
+import heapq
+from itertools import islice, izip, repeat
+
+from VcdHistory import TIME_TYPECODE, create_values_buffer
+from ValueDictView import MemoryContents
+
+def memory_key(memory_name):
+  """Returns the key of a memory's VcdMemory among the histories, which can't
+  collide with a VCD code (those are strings)."""
+  return ('memory', memory_name)
+
+class VcdMemory(object):
+  """
+  Contents of a memory inferred from the element nets of a dump (name[i]), as
+  the initial value of each element and a time-ordered log of writes, with the
+  log entries writing each address indexed. Reading any address after any
+  number of writes is a binary search, and the writes in a cycle are only as
+  many log entries, however deep the memory.
+  A VcdMemory stands in for the VcdHistory of its memory node: entry 0 of the
+  log is the initial contents, times and seek() are as in VcdHistory, and
+  values[entry] is the contents once the log up to entry is applied.
+  """
+  def __init__(self, size, initial_values, initial_time=0):
+    """initial_values is a map from element address to initial value."""
+    self.initial_values = initial_values
+    self.times = array(TIME_TYPECODE, [initial_time])
+    self.addresses = array('l', [-1])
+    self.write_values = create_values_buffer(size, [0])
+    self.address_entries = {}  # map from address to array of log entries
+    self.values = VcdMemorySnapshots(self)
+
+  @classmethod
+  def from_elements(cls, size, elements):
+    """Creates the memory of element histories, given as a list of (address,
+    VcdHistory). Like seeking, each element is taken to hold its first value
+    until it first changes."""
+    elements = [element for element in elements if len(element[1])]
+    memory = cls(size, dict((address, history.values[0])
+                            for address, history in elements),
+                 min([history.times[0] for _, history in elements] or [0]))
+    memory.extend_writes([(address, VcdHistoryTail(history))
+                          for address, history in elements])
+    return memory
+
+  def extend_writes(self, elements):
+    """Appends the changes of element histories (a list of (address,
+    VcdHistory), all later than the logged writes) to the log, in time
+    order."""
+    writes = heapq.merge(*[izip(history.times, repeat(address), history.values)
+                           for address, history in elements])
+    times_append = self.times.append
+    addresses_append = self.addresses.append
+    values_append = self.write_values.append
+    address_entries = self.address_entries
+    entry = len(self.times)
+    for time, address, value in writes:
+      times_append(time)
+      addresses_append(address)
+      values_append(value)
+      entries = address_entries.get(address)
+      if entries is None:
+        entries = address_entries[address] = array('l')
+      entries.append(entry)
+      entry += 1
+
+  def __len__(self):
+    return len(self.times)
+
+  def seek(self, cycle):
+    return max(bisect_right(self.times, cycle) - 1, 0)
+
+  def has_element(self, address):
+    return address in self.initial_values
+
+  def read(self, address, entry):
+    """Returns the value of an address once the log up to entry is applied."""
+    entries = self.address_entries.get(address)
+    if entries is not None:
+      idx = bisect_right(entries, entry) - 1
+      if idx >= 0:
+        return self.write_values[entries[idx]]
+    return self.initial_values[address]
+
+class VcdHistoryTail(object):
+  """The entries of a VcdHistory after the first, without copying them."""
+  def __init__(self, history):
+    self.times = islice(history.times, 1, None)
+    self.values = islice(history.values, 1, None)
+
+class VcdMemorySnapshots(object):
+  """Sequence of the contents of a VcdMemory after each log entry."""
+  def __init__(self, memory):
+    self.memory = memory
+
+  def __getitem__(self, entry):
+    return VcdMemoryContents(self.memory, entry)
+
+  def __len__(self):
+    return len(self.memory)
+
+class VcdMemoryContents(MemoryContents):
+  __slots__ = ('memory', 'entry')
+
+  def __init__(self, memory, entry):
+    self.memory = memory
+    self.entry = entry
+
+  def has_element(self, address):
+    return self.memory.has_element(address)
+
+  def read(self, address):
+    return self.memory.read(address, self.entry)
+
+  def __eq__(self, other):
+    return (isinstance(other, VcdMemoryContents)
+            and self.memory is other.memory and self.entry == other.entry)
+
+  def __ne__(self, other):
+    return not self == other
@@ -0,0 +1,462 @@
+from array import array
+import bz2
+import gzip
+import logging
+import mmap
+import multiprocessing
+import os
+import Queue
+import subprocess
+import threading
+
+from VcdHistory import (VcdHistory, TIME_TYPECODE, create_values_buffer,
+                        vcd_val_to_int)
+
+# Size of the blocks the dump is tokenized in. Blocks are trimmed back to the
+# last newline, so a value change never straddles two blocks.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Smallest part of the value changes worth handing to a worker process.
+MIN_RANGE_SIZE = 32 * 1024 * 1024
+
+# Map from compressed dump filename suffix to the command decompressing it to
+# stdout, and the Python module equivalent used if the command is missing.
+DECOMPRESSORS = {
+  '.gz': (['gzip', '-dc'], gzip.GzipFile),
+  '.bz2': (['bzip2', '-dc'], bz2.BZ2File),
+  '.xz': (['xz', '-dc'], None),
+}
+# Number of decompressed chunks buffered ahead of the parser.
+DECOMPRESS_QUEUE_SIZE = 4
+
+# Decoded values of scalar changes, x and z read as 0 (like vcd_val_to_int).
+SCALAR_VALUES = {'0': 0, '1': 1, 'x': 0, 'z': 0, 'X': 0, 'Z': 0}
+VECTOR_VALUE_CHARS = frozenset('bBrR')
+
+def decode_vector_value(value_str):
+  try:
+    return int(value_str, 2)
+  except ValueError:
+    # x or z bits, or not binary at all.
+    return vcd_val_to_int(value_str.lower())
+
+def iter_file_chunks(filename, chunk_size=CHUNK_SIZE, begin=0, end=None):
+  """Yields the contents of a file (or of its bytes [begin, end), which should
+  be on line boundaries) as large strings ending on line boundaries, read
+  through a memory map so the OS pages the dump in as needed.
+  """
+  with open(filename, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if end is not None:
+      size = min(size, end)
+    if size <= begin:
+      return
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      pos = begin
+      while pos < size:
+        end = min(pos + chunk_size, size)
+        if end < size:
+          newline = mm.rfind('\n', pos, end)
+          if newline < 0:
+            # Line longer than a chunk, extend to the end of it.
+            newline = mm.find('\n', end)
+          if newline >= 0:
+            end = newline + 1
+          else:
+            end = size
+        yield mm[pos:end]
+        pos = end
+    finally:
+      mm.close()
+
+def is_compressed(filename):
+  return os.path.splitext(filename)[1] in DECOMPRESSORS
+
+def iter_vcd_chunks(filename, chunk_size=CHUNK_SIZE):
+  """Yields the contents of a dump as large strings ending on line
+  boundaries, decompressing it on the fly if it is compressed."""
+  if is_compressed(filename):
+    return iter_decompressed_chunks(filename, chunk_size)
+  return iter_file_chunks(filename, chunk_size)
+
+def iter_line_chunks(read, chunk_size):
+  """Yields the data returned by read(chunk_size) (until it returns nothing)
+  as strings ending on line boundaries."""
+  pending = ''
+  while True:
+    data = read(chunk_size)
+    if not data:
+      break
+    if pending:
+      data = pending + data
+    newline = data.rfind('\n')
+    if newline < 0:
+      pending = data
+      continue
+    pending = data[newline+1:]
+    yield data[:newline+1]
+  if pending:
+    yield pending
+
+def iter_decompressed_chunks(filename, chunk_size=CHUNK_SIZE):
+  """Yields the decompressed contents of a compressed dump like
+  iter_file_chunks. Decompression runs concurrently with the consumer, in a
+  decompressor subprocess, or in a thread if the command isn't available."""
+  command, module_open = DECOMPRESSORS[os.path.splitext(filename)[1]]
+  if not os.path.exists(filename):
+    raise IOError("No such file: '%s'" % filename)
+  try:
+    proc = subprocess.Popen(command + [filename], stdout=subprocess.PIPE)
+  except OSError as e:
+    if module_open is None:
+      raise IOError("Unable to run '%s' to decompress '%s': %s"
+                    % (command[0], filename, e))
+    logging.info("'%s' not available, decompressing '%s' in a thread",
+                 command[0], filename)
+    for chunk in iter_threaded_chunks(module_open(filename, 'rb'), chunk_size):
+      yield chunk
+    return
+
+  finished = False
+  try:
+    for chunk in iter_line_chunks(proc.stdout.read, chunk_size):
+      yield chunk
+    finished = True
+  finally:
+    proc.stdout.close()
+    if not finished and proc.poll() is None:
+      # Stopped early, the decompressor may be blocked writing.
+      proc.kill()
+    returncode = proc.wait()
+  if returncode != 0:
+    raise IOError("'%s' failed decompressing '%s' (exit status %i)"
+                  % (command[0], filename, returncode))
+
+def iter_threaded_chunks(f, chunk_size):
+  """Yields iter_line_chunks of a file object, read by a background thread."""
+  chunks = Queue.Queue(DECOMPRESS_QUEUE_SIZE)
+  stop = threading.Event()
+  def reader():
+    try:
+      for chunk in iter_line_chunks(f.read, chunk_size):
+        while not stop.is_set():
+          try:
+            chunks.put((chunk, None), timeout=0.1)
+            break
+          except Queue.Full:
+            pass
+        if stop.is_set():
+          return
+      chunks.put((None, None))
+    except (IOError, EOFError) as e:
+      chunks.put((None, e))
+    finally:
+      f.close()
+  thread = threading.Thread(target=reader, name="VCD decompressor")
+  thread.daemon = True
+  thread.start()
+  try:
+    while True:
+      chunk, error = chunks.get()
+      if error is not None:
+        raise error
+      if chunk is None:
+        break
+      yield chunk
+  finally:
+    stop.set()
+    thread.join()
+
+class VcdParser(object):
+  """
+  Streaming VCD tokenizer. Blocks of the dump (ending on line boundaries) are
+  fed in order through feed(), and are split into whitespace delimited tokens
+  in one pass instead of being matched line-by-line. Values are decoded to
+  integers as they are read, straight into each code's VcdHistory buffers.
+  """
+  def __init__(self, siglist=None):
+    """siglist is an optional collection of full net names (hier.name) to
+    keep; value changes of other nets are skipped without being stored.
+    Bit-select and memory element nets (name[...]) are also kept if their base
+    name is listed, so a bus or memory can be selected as a whole."""
+    if siglist is not None:
+      siglist = frozenset(siglist)
+    self.siglist = siglist
+
+    self.data = {}  # map from VCD code to {'nets': [net_dict, ...]}
+    self.histories = {}  # map from VCD code to VcdHistory, once the header ends
+    # map from VCD code to the (time, value) sinks of its changes, by default
+    # the append methods of its history buffers
+    self.appenders = {}
+
+    self.in_header = True
+    self.header_tokens = []  # tokens of the header statement being parsed
+    self.hier = []
+    self.timescale = None  # like '1ps', if the header has one
+
+    self.in_comment = False
+    self.time = 0
+
+    self.nets_count = 0
+    self.nets_kept_count = 0
+
+  def feed(self, chunk):
+    """Tokenizes a block of the dump."""
+    tokens = chunk.split()
+    if self.in_header:
+      body_begin = self.parse_header_tokens(tokens)
+      if self.in_header:
+        return
+      tokens = tokens[body_begin:]
+    self.parse_change_tokens(tokens)
+
+  def parse_header_tokens(self, tokens):
+    """Parses header statements (up to $enddefinitions), returning the index of
+    the first value change token."""
+    statement = self.header_tokens
+    for idx, token in enumerate(tokens):
+      if token != '$end':
+        statement.append(token)
+        continue
+      if statement:
+        keyword = statement[0]
+        if keyword == '$scope':
+          # $scope module dff $end
+          self.hier.append(statement[2])
+        elif keyword == '$upscope':
+          self.hier.pop()
+        elif keyword == '$var':
+          # $var wire 4 ) addr [3:0] $end
+          self.add_var(statement[1], statement[2], statement[3],
+                       "".join(statement[4:]))
+        elif keyword == '$timescale':
+          self.timescale = "".join(statement[1:])
+        elif keyword == '$enddefinitions':
+          self.header_tokens = []
+          self.end_header()
+          return idx + 1
+      statement = self.header_tokens = []
+    return len(tokens)
+
+  def add_var(self, var_type, size, code, name):
+    path = '.'.join(self.hier)
+    self.nets_count += 1
+    if self.siglist is not None and not self.want_net(path, name):
+      return
+    self.nets_kept_count += 1
+    if code not in self.data:
+      self.data[code] = {'nets': []}
+    var_struct = {
+      'type': var_type,
+      'name': name,
+      'size': size,
+      'hier': path,
+    }
+    if var_struct not in self.data[code]['nets']:
+      self.data[code]['nets'].append(var_struct)
+
+  def want_net(self, path, name):
+    full_name = path + '.' + name
+    if full_name in self.siglist:
+      return True
+    bracket_begin = full_name.rfind('[')
+    return bracket_begin > 0 and full_name[:bracket_begin] in self.siglist
+
+  def end_header(self):
+    self.in_header = False
+    if not self.data:
+      if self.siglist is None:
+        raise ValueError("No signals were found in the VCD file")
+      else:
+        raise ValueError("No matching signals were found in the VCD file")
+    for code, code_dict in self.data.iteritems():
+      size = max(int(net_dict['size'], 10) for net_dict in code_dict['nets'])
+      history = VcdHistory(array(TIME_TYPECODE), create_values_buffer(size))
+      self.histories[code] = history
+      self.appenders[code] = (history.times.append, history.values.append)
+    logging.info("VCD header parsed, keeping %i of %i nets (%i codes)",
+                 self.nets_kept_count, self.nets_count, len(self.data))
+
+  def resume(self, time, in_comment, appenders):
+    """Continues parsing value changes from a line boundary in the body, where
+    the current time is time (and in a $comment if in_comment is set), sending
+    changes to appenders (see __init__) instead of the histories."""
+    assert not self.in_header
+    self.time = time
+    self.in_comment = in_comment
+    self.appenders = appenders
+
+  def parse_change_tokens(self, tokens):
+    appenders_get = self.appenders.get
+    time = self.time
+    it = iter(tokens)
+
+    if self.in_comment:
+      self.in_comment = self.skip_comment(it)
+
+    for token in it:
+      first = token[0]
+      if first == '#':
+        time = int(token[1:])
+      elif first in SCALAR_VALUES:
+        appenders = appenders_get(token[1:])
+        if appenders is not None:
+          appenders[0](time)
+          appenders[1](SCALAR_VALUES[first])
+      elif first in VECTOR_VALUE_CHARS:
+        appenders = appenders_get(next(it))
+        if appenders is not None:
+          appenders[0](time)
+          appenders[1](decode_vector_value(token[1:]))
+      elif first == '$':
+        # $dumpvars, $dumpall, $dumpon, $dumpoff and their $end carry no
+        # information by themselves, only $comment bodies need skipping.
+        if token == '$comment':
+          self.in_comment = self.skip_comment(it)
+      else:
+        raise ValueError("Unexpected token in VCD value changes: '%s'" % token)
+
+    self.time = time
+
+  @staticmethod
+  def skip_comment(it):
+    """Consumes tokens up to and including $end, returning True if the comment
+    continues into the next block."""
+    for token in it:
+      if token == '$end':
+        return False
+    return True
+
+  def get_result(self):
+    """Returns the parsed dump as a map from VCD code to
+    {'nets': [net_dict, ...], 'history': VcdHistory}, with net_dicts as in the
+    Verilog_VCD.parse_vcd format. Signals without a value change read as
+    0."""
+    for code, history in self.histories.iteritems():
+      if not len(history):
+        history.times.append(0)
+        history.values.append(0)
+      self.data[code]['history'] = history
+    return self.data
+
+def parse_vcd(filename, siglist=None, chunk_size=CHUNK_SIZE, processes=1):
+  """Parses a VCD file into decoded value histories (see
+  VcdParser.get_result), using a memory-mapped, block-tokenizing parser.
+  Compressed dumps (see DECOMPRESSORS) are decompressed while being parsed.
+  With processes > 1, large uncompressed dumps have their value changes split
+  into ranges parsed by that many worker processes."""
+  if processes > 1 and not is_compressed(filename):
+    ranges = split_vcd_body(filename, processes)
+    if ranges is not None and len(ranges) > 1:
+      return parse_vcd_parallel(filename, siglist, chunk_size, processes,
+                                ranges)
+  parser = VcdParser(siglist)
+  for chunk in iter_vcd_chunks(filename, chunk_size):
+    parser.feed(chunk)
+  if parser.in_header:
+    raise ValueError("VCD file '%s' has no $enddefinitions" % filename)
+  return parser.get_result()
+
+def find_body_begin(mm):
+  """Returns the offset following $enddefinitions $end in a mapped dump, or -1
+  if there is none."""
+  definitions_end = mm.find('$enddefinitions')
+  if definitions_end < 0:
+    return -1
+  body_begin = mm.find('$end', definitions_end + len('$enddefinitions'))
+  if body_begin < 0:
+    return -1
+  return body_begin + len('$end')
+
+def parse_vcd_header(filename, siglist=None, chunk_size=CHUNK_SIZE):
+  """Parses only the header of an uncompressed dump, returning the VcdParser
+  (ready to resume at the first value change) and the offset of the value
+  changes."""
+  if is_compressed(filename):
+    raise ValueError("VCD file '%s' is compressed, it can't be read by offset"
+                     % filename)
+  with open(filename, 'rb') as f:
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      body_begin = find_body_begin(mm)
+    finally:
+      mm.close()
+  if body_begin < 0:
+    raise ValueError("VCD file '%s' has no $enddefinitions" % filename)
+  parser = VcdParser(siglist)
+  for chunk in iter_file_chunks(filename, chunk_size, 0, body_begin):
+    parser.feed(chunk)
+  assert not parser.in_header
+  return parser, body_begin
+
+def split_vcd_body(filename, count):
+  """Returns up to count byte ranges [(begin, end), ...] splitting the value
+  changes of a dump at '#time' lines, or None if the dump has no
+  $enddefinitions. Ranges are at least MIN_RANGE_SIZE long.
+  Note that a '#' starting a line in a $comment spanning a split is taken as a
+  time."""
+  with open(filename, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+      return None
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      body_begin = find_body_begin(mm)
+      if body_begin < 0:
+        return None
+
+      count = max(min(count, (size - body_begin) // MIN_RANGE_SIZE), 1)
+      splits = [body_begin]
+      for i in xrange(1, count):
+        target = body_begin + (size - body_begin) * i // count
+        split = mm.find('\n#', max(target, splits[-1]))
+        if split < 0:
+          break
+        splits.append(split + 1)
+      splits.append(size)
+    finally:
+      mm.close()
+  return zip(splits[:-1], splits[1:])
+
+def parse_vcd_range(args):
+  """Worker process entry point, parsing the header and one range of value
+  changes, and returning the histories as raw buffers:
+  {VCD code: (times string, values string or list)}."""
+  filename, siglist, chunk_size, begin, end = args
+  parser, _ = parse_vcd_header(filename, siglist, chunk_size)
+  for chunk in iter_file_chunks(filename, chunk_size, begin, end):
+    parser.feed(chunk)
+  buffers = {}
+  for code, history in parser.histories.iteritems():
+    if isinstance(history.values, array):
+      values = history.values.tostring()
+    else:
+      values = history.values
+    buffers[code] = (history.times.tostring(), values)
+  return buffers
+
+def parse_vcd_parallel(filename, siglist, chunk_size, processes, ranges):
+  logging.info("Parsing VCD value changes in %i ranges with %i processes",
+               len(ranges), processes)
+  parser, _ = parse_vcd_header(filename, siglist, chunk_size)
+
+  pool = multiprocessing.Pool(min(processes, len(ranges)))
+  try:
+    # Ranges are in file (and so time) order, so histories merge by
+    # concatenating them in order.
+    for buffers in pool.imap(parse_vcd_range,
+                             [(filename, siglist, chunk_size, begin, end)
+                              for begin, end in ranges]):
+      for code, (times, values) in buffers.iteritems():
+        history = parser.histories[code]
+        history.times.fromstring(times)
+        if isinstance(history.values, array):
+          history.values.fromstring(values)
+        else:
+          history.values.extend(values)
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+  return parser.get_result()
@@ -0,0 +1,236 @@
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict
+from functools import partial
+import logging
+
+from HierarchyIndex import HierarchyIndex
+from VcdCircuit import VcdCircuitBase, build_layout_histories, build_vcd_layout
+from VcdHistory import (VcdHistory, TIME_TYPECODE, VALUE_TYPECODE,
+                        VALUE_TYPECODE_BITS, create_values_buffer)
+from VcdParser import iter_file_chunks, parse_vcd_header
+
+from Common import TemporalNode
+
+# Parser state at a line boundary in the value changes: the current time,
+# whether in a $comment, and the values of all VCD codes by then (see
+# VcdTimeIndex.snapshot_values).
+VcdCheckpoint = namedtuple('VcdCheckpoint', ['offset', 'time', 'in_comment',
+                                             'values'])
+
+# Default number of bytes of value changes between checkpoints.
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+# Size of the blocks windows are parsed in, checking for their end in between.
+WINDOW_CHUNK_SIZE = 1024 * 1024
+# Default number of cycles parsed at once, and number of those kept.
+WINDOW_CYCLES = 1024
+WINDOW_CACHE_SIZE = 8
+
+def discard_time(time):
+  pass
+
+class VcdTimeIndex(object):
+  """
+  Index of the value changes of a dump by time, made of checkpoints of the
+  parser state every checkpoint_bytes. It is built incrementally, scanning
+  forward only as far as has been asked for, and allows parsing an arbitrary
+  time window starting from the checkpoint before it.
+  """
+  def __init__(self, filename, siglist=None, checkpoint_bytes=CHECKPOINT_BYTES):
+    self.filename = filename
+    self.checkpoint_bytes = checkpoint_bytes
+    self.parser, body_begin = parse_vcd_header(filename, siglist)
+
+    self.sizes = {}
+    for code, code_dict in self.parser.data.iteritems():
+      self.sizes[code] = max(int(net_dict['size'], 10)
+                             for net_dict in code_dict['nets'])
+    # Checkpointed values are stored in this code order, in an array for
+    # codes fitting in one, and a tuple for the others.
+    self.narrow_codes = sorted(code for code, size in self.sizes.iteritems()
+                               if size <= VALUE_TYPECODE_BITS)
+    self.wide_codes = sorted(code for code, size in self.sizes.iteritems()
+                             if size > VALUE_TYPECODE_BITS)
+
+    self.checkpoints = [VcdCheckpoint(body_begin, 0, False,
+                                      self.snapshot_values({}))]
+    self.checkpoint_times = [0]
+    self.scanned = False  # whether checkpoints reach the end of the dump
+
+  def get_nets(self):
+    """Returns the map from VCD code to its list of net dicts."""
+    return dict((code, code_dict['nets'])
+                for code, code_dict in self.parser.data.iteritems())
+
+  def snapshot_values(self, values):
+    """Packs a map from VCD code to value, where codes without a value yet
+    read as 0."""
+    return (array(VALUE_TYPECODE, [values.get(code, 0)
+                                   for code in self.narrow_codes]),
+            tuple(values.get(code, 0) for code in self.wide_codes))
+
+  def restore_values(self, checkpoint):
+    narrow_values, wide_values = checkpoint.values
+    values = dict(zip(self.narrow_codes, narrow_values))
+    values.update(zip(self.wide_codes, wide_values))
+    return values
+
+  def iter_chunks(self, checkpoint, chunk_size):
+    """Yields (chunk, offset following it) for the value changes following a
+    checkpoint."""
+    offset = checkpoint.offset
+    for chunk in iter_file_chunks(self.filename, chunk_size, offset):
+      offset += len(chunk)
+      yield chunk, offset
+
+  def scan_to(self, time):
+    """Extends the checkpoints up to one past time, or to the end of the
+    dump."""
+    checkpoint = self.checkpoints[-1]
+    if self.scanned or checkpoint.time > time:
+      return
+    values = self.restore_values(checkpoint)
+    self.parser.resume(checkpoint.time, checkpoint.in_comment,
+                       dict((code, (discard_time, partial(values.__setitem__, code)))
+                            for code in self.sizes))
+    for chunk, offset in self.iter_chunks(checkpoint, self.checkpoint_bytes):
+      self.parser.feed(chunk)
+      checkpoint = VcdCheckpoint(offset, self.parser.time,
+                                 self.parser.in_comment,
+                                 self.snapshot_values(values))
+      self.checkpoints.append(checkpoint)
+      self.checkpoint_times.append(checkpoint.time)
+      if checkpoint.time > time:
+        return
+    self.scanned = True
+    logging.info("VCD time index complete, %i checkpoints",
+                 len(self.checkpoints))
+
+  def load_window(self, begin_time, end_time):
+    """Parses the value changes up to end_time (and possibly past it) from the
+    checkpoint before begin_time, returning a map from VCD code to VcdHistory
+    starting with the code's value at that checkpoint."""
+    self.scan_to(begin_time)
+    idx = max(bisect_right(self.checkpoint_times, begin_time) - 1, 0)
+    checkpoint = self.checkpoints[idx]
+
+    histories = {}
+    appenders = {}
+    for code, value in self.restore_values(checkpoint).iteritems():
+      history = VcdHistory(array(TIME_TYPECODE, [checkpoint.time]),
+                           create_values_buffer(self.sizes[code], [value]))
+      histories[code] = history
+      appenders[code] = (history.times.append, history.values.append)
+    self.parser.resume(checkpoint.time, checkpoint.in_comment, appenders)
+    for chunk, _ in self.iter_chunks(checkpoint,
+                                     min(WINDOW_CHUNK_SIZE, self.checkpoint_bytes)):
+      self.parser.feed(chunk)
+      if self.parser.time >= end_time:
+        break
+    return histories
+
+class VcdWindowedCircuit(VcdCircuitBase):
+  """
+  Circuit for dumps too large to load, which only parses the windows of
+  cycles being viewed (keeping the most recently used few), starting from a
+  VcdTimeIndex of the dump. Startup only parses the header and first window,
+  and memory use depends on the window size rather than the dump length.
+  Signals without a value yet read as 0. Compressed dumps aren't supported, as
+  windows are read by file offset.
+  """
+  def __init__(self, vcd_filename, timescale_divisor=1, start_cycle=0,
+               signals=None, window_cycles=WINDOW_CYCLES,
+               window_cache_size=WINDOW_CACHE_SIZE,
+               checkpoint_bytes=CHECKPOINT_BYTES):
+    super(VcdWindowedCircuit, self).__init__()
+    assert isinstance(timescale_divisor, int) and timescale_divisor >= 1
+    assert window_cycles > 0 and window_cache_size > 0
+    self.timescale_divisor = timescale_divisor
+    self.window_cycles = window_cycles
+    self.window_cache_size = window_cache_size
+    self.windows = OrderedDict()  # map from window number to its histories
+    self.last_state = (None, None)  # (cycle, state) last generated
+
+    logging.info("Indexing VCD file '%s'..." % vcd_filename)
+    self.index = VcdTimeIndex(vcd_filename, signals, checkpoint_bytes)
+    self.layout = build_vcd_layout(self.index.get_nets())
+    self.memory_depths = self.layout.memory_depths
+
+    self.width_dict = {}
+    for node_name, (_, size) in self.layout.nodes.iteritems():
+      self.width_dict[node_name] = size
+    for node_name, (_, size) in self.layout.bundles.iteritems():
+      assert node_name not in self.width_dict
+      self.width_dict[node_name] = size
+    logging.info("%i nodes found", len(self.width_dict))
+    self.hierarchy = HierarchyIndex.from_nodes(self.width_dict,
+                                               self.memory_depths)
+
+    self.init_views(start_cycle)
+
+  def get_window(self, window):
+    """Returns the map from node name to (scaled) VcdHistory covering a window
+    of cycles, parsing it if it isn't cached."""
+    histories = self.windows.pop(window, None)
+    if histories is None:
+      begin_time = window * self.window_cycles * self.timescale_divisor
+      end_time = (window + 1) * self.window_cycles * self.timescale_divisor
+      code_histories = self.index.load_window(begin_time, end_time)
+      key_histories, nodes = build_layout_histories(self.layout, code_histories)
+      histories = {}
+      for node_name, (vcd_key, _) in nodes.iteritems():
+        histories[node_name] = key_histories[vcd_key].scaled(
+            self.timescale_divisor)
+      if len(self.windows) >= self.window_cache_size:
+        self.windows.popitem(last=False)
+    self.windows[window] = histories
+    return histories
+
+  def get_state(self, cycle):
+    """Returns the map from node name to value at a cycle."""
+    if self.last_state[0] != cycle:
+      histories = self.get_window(cycle // self.window_cycles)
+      state = {}
+      for node_name, history in histories.iteritems():
+        state[node_name] = history.values[history.seek(cycle)]
+      self.last_state = (cycle, state)
+    return self.last_state[1]
+
+  def create_temporal_node(self, cycle, from_node=None):
+    return VcdWindowedTemporalNode(self, None, cycle)
+
+class VcdWindowedTemporalNode(TemporalNode):
+  """Node of a cycle whose state is generated by the circuit's get_state."""
+  def __init__(self, circuit, prev_node, cycle):
+    self.circuit = circuit
+    self.prev_node = prev_node
+    self.next_node = None
+    self.cycle = cycle
+
+  def get_historical_state(self):
+    return self.circuit.get_state(self.cycle)
+
+  def get_snapshot_state(self):
+    return self.circuit.get_state(self.cycle)
+
+  def get_label(self):
+    return str(self.cycle)
+
+  def get_prev_time(self):
+    if self.prev_node is None and self.cycle > 0:
+      self.prev_node = VcdWindowedTemporalNode(self.circuit, None,
+                                               self.cycle - 1)
+      self.prev_node.next_node = self
+    return self.prev_node
+
+  def get_next_time(self):
+    if self.next_node is None:
+      self.next_node = VcdWindowedTemporalNode(self.circuit, self,
+                                               self.cycle + 1)
+    return self.next_node
+
+  def get_prev_mod(self):
+    return None
+
+  def get_next_mod(self):
+    return None
@@ -0,0 +1,61 @@
+import logging
+
+from HierarchyIndex import HierarchyIndex
+from VcdCircuit import VcdCircuitBase, VcdLayout
+from VcdWindowedCircuit import VcdWindowedTemporalNode
+from WaveFile import WaveFile
+
+class WaveCircuit(VcdCircuitBase):
+  """
+  Circuit reading a waveform file (see WaveFile, converted from a dump by
+  convert_vcd). Nothing is loaded up front beyond the index: the state at a
+  cycle is read from the blocks in effect then, so startup and seeks cost the
+  same for any trace length. Nodes are those of VcdWindowedCircuit.
+  """
+  def __init__(self, filename, timescale_divisor=1, start_cycle=0):
+    super(WaveCircuit, self).__init__()
+    assert isinstance(timescale_divisor, int) and timescale_divisor >= 1
+    self.timescale_divisor = timescale_divisor
+    self.last_state = (None, None)  # (cycle, state) last generated
+
+    logging.info("Opening waveform file '%s'..." % filename)
+    self.wave = WaveFile(filename)
+    self.layout = VcdLayout(*self.wave.layout)
+    self.memory_depths = self.layout.memory_depths
+
+    self.width_dict = {}
+    for node_name, (_, size) in self.layout.nodes.iteritems():
+      self.width_dict[node_name] = size
+    for node_name, (_, size) in self.layout.bundles.iteritems():
+      assert node_name not in self.width_dict
+      self.width_dict[node_name] = size
+    logging.info("%i nodes found", len(self.width_dict))
+    self.hierarchy = HierarchyIndex.from_nodes(self.width_dict,
+                                               self.memory_depths)
+
+    self.init_views(start_cycle)
+
+  def get_state(self, cycle):
+    """Returns the map from node name to value at a cycle."""
+    if self.last_state[0] != cycle:
+      # The last dump time which scales to this cycle.
+      time = (cycle + 1) * self.timescale_divisor - 1
+      get_value = self.wave.get_value
+      values = {}
+      state = {}
+      for node_name, (vcd_key, _) in self.layout.nodes.iteritems():
+        if vcd_key not in values:
+          values[vcd_key] = get_value(vcd_key, time)
+        state[node_name] = values[vcd_key]
+      for node_name, (fields, _) in self.layout.bundles.iteritems():
+        value = 0
+        for low, _, vcd_key in fields:
+          if vcd_key not in values:
+            values[vcd_key] = get_value(vcd_key, time)
+          value |= values[vcd_key] << low
+        state[node_name] = value
+      self.last_state = (cycle, state)
+    return self.last_state[1]
+
+  def create_temporal_node(self, cycle, from_node=None):
+    return VcdWindowedTemporalNode(self, None, cycle)
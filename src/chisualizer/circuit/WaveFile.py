@@ -0,0 +1,225 @@
+import argparse
+from array import array
+from bisect import bisect_right
+import cPickle as pickle
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from VcdCircuit import build_vcd_layout
+from VcdHistory import VcdHistory, TIME_TYPECODE
+from VcdParser import CHUNK_SIZE, VcdParser, iter_vcd_chunks
+
+# Compact binary waveform file, converted from a dump in one streaming pass:
+#   WAVE_MAGIC, then version and index offset (struct '<IQ')
+#   change blocks: per VCD code, runs of up to block_changes (time, value)
+#     entries, stored as a zlib compressed times buffer followed by a zlib
+#     compressed values buffer (or pickled list of values, for wide signals)
+#   index (pickled, to the end of the file): {
+#     'time_typecode': typecode of the times buffers,
+#     'layout': the VcdLayout fields (nodes, bundles, memory_depths),
+#     'codes': map from VCD code to WaveCodeIndex fields,
+#   }
+# Times are as in the dump, unscaled.
+WAVE_SUFFIX = '.chwave'
+WAVE_MAGIC = 'CHWAVE'
+WAVE_VERSION = 1
+HEADER_FORMAT = '<IQ'
+
+# Default number of changes per block, trading compression for the cost of
+# decompressing a block on random access.
+BLOCK_CHANGES = 256
+COMPRESS_LEVEL = 6
+
+# Typecode marking a values buffer stored as a pickled list.
+LIST_TYPECODE = 'O'
+
+def wave_filename(vcd_filename):
+  """Returns the default waveform filename for a (possibly compressed) dump."""
+  base, ext = os.path.splitext(vcd_filename)
+  if ext != '.vcd':
+    base, ext = os.path.splitext(base)
+    if ext != '.vcd':
+      base = vcd_filename
+  return base + WAVE_SUFFIX
+
+class WaveCodeIndex(object):
+  """
+  Index of the blocks of one VCD code: their first times (to bisect), file
+  offsets and compressed lengths.
+  """
+  __slots__ = ('values_typecode', 'block_times', 'block_offsets',
+               'block_lens')
+
+  def __init__(self, values_typecode, block_times, block_offsets, block_lens):
+    self.values_typecode = values_typecode
+    self.block_times = block_times
+    self.block_offsets = block_offsets
+    self.block_lens = block_lens  # list of (times length, values length)
+
+  def __getstate__(self):
+    return (self.values_typecode, self.block_times, self.block_offsets,
+            self.block_lens)
+
+  def __setstate__(self, state):
+    (self.values_typecode, self.block_times, self.block_offsets,
+     self.block_lens) = state
+
+class WaveWriter(object):
+  """Writes the blocks of a waveform file as they are filled, then its
+  index."""
+  def __init__(self, f):
+    self.f = f
+    self.codes = {}  # map from VCD code to WaveCodeIndex
+    f.write(WAVE_MAGIC)
+    f.write(struct.pack(HEADER_FORMAT, WAVE_VERSION, 0))
+    self.offset = len(WAVE_MAGIC) + struct.calcsize(HEADER_FORMAT)
+
+  def write_block(self, code, history, count):
+    """Writes the first count entries of a VcdHistory as a block of a code."""
+    times = history.times[:count]
+    values = history.values[:count]
+    times_data = zlib.compress(times.tostring(), COMPRESS_LEVEL)
+    if isinstance(values, array):
+      values_typecode = values.typecode
+      values_data = values.tostring()
+    else:
+      values_typecode = LIST_TYPECODE
+      values_data = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+    values_data = zlib.compress(values_data, COMPRESS_LEVEL)
+
+    code_index = self.codes.get(code)
+    if code_index is None:
+      code_index = WaveCodeIndex(values_typecode, array(times.typecode),
+                                 array('L'), [])
+      self.codes[code] = code_index
+    code_index.block_times.append(times[0])
+    code_index.block_offsets.append(self.offset)
+    code_index.block_lens.append((len(times_data), len(values_data)))
+    self.f.write(times_data)
+    self.f.write(values_data)
+    self.offset += len(times_data) + len(values_data)
+
+  def flush_history(self, code, history, block_changes, final=False):
+    """Writes the full blocks of a history (and if final is set, the partial
+    last one), removing them from it."""
+    while len(history) >= block_changes or (final and len(history)):
+      count = min(len(history), block_changes)
+      self.write_block(code, history, count)
+      del history.times[:count]
+      del history.values[:count]
+
+  def finish(self, layout):
+    """Writes the index, given the VcdLayout of the dump."""
+    index = pickle.dumps({
+      'time_typecode': TIME_TYPECODE,
+      'layout': tuple(layout),
+      'codes': self.codes,
+    }, pickle.HIGHEST_PROTOCOL)
+    self.f.write(index)
+    self.f.seek(len(WAVE_MAGIC))
+    self.f.write(struct.pack(HEADER_FORMAT, WAVE_VERSION, self.offset))
+
+def convert_vcd(vcd_filename, filename=None, siglist=None,
+                block_changes=BLOCK_CHANGES, chunk_size=CHUNK_SIZE):
+  """Converts a (possibly compressed) dump to a waveform file in one pass,
+  holding at most a block of changes per VCD code in memory. Returns the
+  waveform filename."""
+  if filename is None:
+    filename = wave_filename(vcd_filename)
+  temp_filename = filename + '.tmp'
+  logging.info("Converting VCD file '%s' to '%s'...", vcd_filename, filename)
+  parser = VcdParser(siglist)
+  with open(temp_filename, 'wb') as f:
+    writer = WaveWriter(f)
+    for chunk in iter_vcd_chunks(vcd_filename, chunk_size):
+      parser.feed(chunk)
+      # Parser appenders are bound to the history buffers, which are only
+      # trimmed in place.
+      for code, history in parser.histories.iteritems():
+        if len(history) >= block_changes:
+          writer.flush_history(code, history, block_changes)
+    if parser.in_header:
+      raise ValueError("VCD file '%s' has no $enddefinitions" % vcd_filename)
+    for code, history in parser.histories.iteritems():
+      writer.flush_history(code, history, block_changes, final=True)
+    writer.finish(build_vcd_layout(dict(
+        (code, code_dict['nets']) for code, code_dict in parser.data.iteritems())))
+  os.rename(temp_filename, filename)
+  logging.info("Wrote waveform file '%s'", filename)
+  return filename
+
+class WaveFile(object):
+  """
+  Random access reader of a waveform file. The file is memory-mapped, and
+  blocks are decompressed as values in them are read, keeping the last one
+  read of each VCD code (as reads usually move forward in time).
+  """
+  def __init__(self, filename):
+    self.filename = filename
+    with open(filename, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    pos = len(WAVE_MAGIC)
+    if self.mm[:pos] != WAVE_MAGIC:
+      raise ValueError("'%s' is not a waveform file" % filename)
+    version, index_offset = struct.unpack(
+        HEADER_FORMAT, self.mm[pos:pos+struct.calcsize(HEADER_FORMAT)])
+    if version != WAVE_VERSION:
+      raise ValueError("Waveform file '%s' has unsupported version %i"
+                       % (filename, version))
+    if index_offset == 0:
+      raise ValueError("Waveform file '%s' is incomplete" % filename)
+    index = pickle.loads(self.mm[index_offset:])
+    self.time_typecode = index['time_typecode']
+    self.layout = index['layout']
+    self.codes = index['codes']
+    # map from VCD code to (block number, VcdHistory) last decompressed
+    self.blocks = {}
+
+  def close(self):
+    self.mm.close()
+
+  def read_block(self, code, block):
+    """Returns a block of a VCD code as a VcdHistory."""
+    code_index = self.codes[code]
+    offset = code_index.block_offsets[block]
+    times_len, values_len = code_index.block_lens[block]
+    times = array(self.time_typecode)
+    times.fromstring(zlib.decompress(self.mm[offset:offset + times_len]))
+    offset += times_len
+    values_data = zlib.decompress(self.mm[offset:offset + values_len])
+    if code_index.values_typecode == LIST_TYPECODE:
+      values = pickle.loads(values_data)
+    else:
+      values = array(code_index.values_typecode)
+      values.fromstring(values_data)
+    return VcdHistory(times, values)
+
+  def get_value(self, code, time):
+    """Returns the value of a VCD code at a (dump) time. Times before the
+    first change read the first value, like VcdHistory.seek, and codes without
+    changes read as 0."""
+    code_index = self.codes.get(code)
+    if code_index is None:
+      return 0
+    block = max(bisect_right(code_index.block_times, time) - 1, 0)
+    cached = self.blocks.get(code)
+    if cached is None or cached[0] != block:
+      cached = (block, self.read_block(code, block))
+      self.blocks[code] = cached
+    history = cached[1]
+    return history.values[history.seek(time)]
+
+def run_converter():
+  parser = argparse.ArgumentParser(description="Converts a VCD to a Chisualizer waveform file")
+  parser.add_argument('vcd',
+                      help="VCD file to convert (optionally .gz, .bz2 or .xz compressed).")
+  parser.add_argument('--output', '-o',
+                      help="Waveform file to write (defaults to the VCD name, with a .chwave extension).")
+  parser.add_argument('--block_changes', type=int, default=BLOCK_CHANGES,
+                      help="Number of value changes per compressed block.")
+  args = parser.parse_args()
+  logging.getLogger().setLevel(logging.INFO)
+  convert_vcd(args.vcd, args.output, block_changes=args.block_changes)
@@ -1,5 +1,6 @@
 import argparse
 import logging
+import multiprocessing
 import os
 import sys
 
@@ -12,11 +13,13 @@ except:
   haveWxCairo = False
 
 from chisualizer.circuit.DummyCircuit import DummyCircuit
-from chisualizer.circuit.ChiselEmulatorSubprocess import ChiselEmulatorSubprocess
-from chisualizer.circuit.VcdCircuit import VcdCircuit
+from chisualizer.circuit.ChiselEmulatorSubprocess import ChiselEmulatorSubprocess, MAX_SNAPSHOTS
+from chisualizer.circuit.VcdCircuit import VcdCircuit, KEYFRAME_INTERVAL, STATE_CACHE_BYTES
+from chisualizer.circuit.VcdWindowedCircuit import VcdWindowedCircuit, WINDOW_CYCLES
+from chisualizer.circuit.WaveCircuit import WaveCircuit
 from chisualizer.descriptor.YamlDescriptor import YamlDescriptor
 
-from chisualizer.ui.Manager import ChisualizerManager
+from chisualizer.ui.Manager import ChisualizerManager, get_referenced_paths
 
 def run():
   if not haveWxCairo:
@@ -29,15 +32,43 @@ def run():
   parser.add_argument('--emulator_args', '-a', nargs='*',
                       help="Arguments to pass into the emulator.")
   parser.add_argument('--vcd',
-                      help="VCD file to view.")
+                      help="VCD file to view (optionally .gz, .bz2 or .xz compressed).")
   parser.add_argument('--vcd_start_cycle', type=int, default=0,
                       help="VCD start cycle (post-scaling).")
   parser.add_argument('--vcd_timescale', type=int, default=1,
                       help="Divide all VCD times by this amount.")
+  parser.add_argument('--vcd_referenced_only', action='store_true',
+                      help="Only load VCD signals referenced by the visualizer descriptor.")
+  parser.add_argument('--vcd_no_cache', action='store_true',
+                      help="Don't read or write the parsed VCD cache file next to the dump.")
+  parser.add_argument('--vcd_keyframe_interval', type=int, default=KEYFRAME_INTERVAL,
+                      help="Cycles between VCD state checkpoints used for seeking (0 to disable).")
+  parser.add_argument('--vcd_state_cache_mb', type=int,
+                      default=STATE_CACHE_BYTES // (1024 * 1024),
+                      help="Memory budget (MB) for the states of visited VCD cycles.")
+  parser.add_argument('--vcd_processes', type=int,
+                      default=multiprocessing.cpu_count(),
+                      help="Number of processes to parse large VCDs with.")
+  parser.add_argument('--vcd_lazy', action='store_true',
+                      help="Only parse the windows of VCD cycles being viewed, for dumps too large to load.")
+  parser.add_argument('--vcd_window_cycles', type=int, default=WINDOW_CYCLES,
+                      help="Number of cycles parsed at once with --vcd_lazy.")
+  parser.add_argument('--vcd_follow', action='store_true',
+                      help="Follow a VCD still being written, loading cycles as they are appended.")
+  parser.add_argument('--vcd_progressive', action='store_true',
+                      help="Show the start cycle as soon as it is parsed, loading the rest of the VCD in the background (not for compressed VCDs).")
+  parser.add_argument('--wave',
+                      help="Waveform file to view (converted from a VCD with vcd2wave.py).")
   parser.add_argument('--visualizer_desc', '-d', required=True,
                       help="Path to the visualizer descriptor XML file.")
   parser.add_argument('--emulator_reset', metavar='-r', type=bool, default=True,
                       help="Whether or not to reset the emulator circuit on start.")
+  parser.add_argument('--emulator_binary_framing', action='store_true',
+                      help="Have the emulator reply in binary frames, if it supports them (cheaper for wide values).")
+  parser.add_argument('--emulator_snapshots', type=int, default=MAX_SNAPSHOTS,
+                      help="Number of emulator snapshots kept for navigating back, denser near the current cycle.")
+  parser.add_argument('--emulator_snapshot_mb', type=int,
+                      help="Memory budget (MB) for emulator snapshots, at the estimated size of the circuit state (instead of --emulator_snapshots).")
   parser.add_argument('--log_level', metavar='-l', default="info",
                       choices=['error', 'warning', 'info', 'debug'],
                       help="Logging verbosity level.")
@@ -54,8 +85,12 @@ def run():
   else:
     assert False
     
-  if args.emulator and args.vcd:
-    raise ValueError("Cannot specify both a VCD and emulator")
+  vis_descriptor = YamlDescriptor()
+  vis_descriptor.read_descriptor(os.path.dirname(__file__) + "/vislib.yaml")
+  vis_descriptor.read_descriptor(args.visualizer_desc)
+
+  if len([arg for arg in (args.emulator, args.vcd, args.wave) if arg]) > 1:
+    raise ValueError("Cannot specify more than one of a VCD, waveform file and emulator")
   elif args.emulator:
     if args.emulator == "dummy":  
       circuit = DummyCircuit()
@@ -64,17 +99,37 @@ def run():
       if args.emulator_args:
         emulator_cmd_list.extend(args.emulator_args)
         print emulator_cmd_list
-      circuit = ChiselEmulatorSubprocess(emulator_cmd_list, reset=args.emulator_reset)
+      snapshot_budget_bytes = None
+      if args.emulator_snapshot_mb is not None:
+        snapshot_budget_bytes = args.emulator_snapshot_mb * 1024 * 1024
+      circuit = ChiselEmulatorSubprocess(emulator_cmd_list, reset=args.emulator_reset,
+                                         binary_framing=args.emulator_binary_framing,
+                                         max_snapshots=args.emulator_snapshots,
+                                         snapshot_budget_bytes=snapshot_budget_bytes)
   elif args.vcd:
-    circuit = VcdCircuit(args.vcd, timescale_divisor=args.vcd_timescale,
-                         start_cycle=args.vcd_start_cycle) 
+    signals = None
+    if args.vcd_referenced_only:
+      signals = get_referenced_paths(vis_descriptor)
+      logging.info("Descriptor references %i paths", len(signals))
+    if args.vcd_lazy:
+      circuit = VcdWindowedCircuit(args.vcd, timescale_divisor=args.vcd_timescale,
+                                   start_cycle=args.vcd_start_cycle, signals=signals,
+                                   window_cycles=args.vcd_window_cycles)
+    else:
+      circuit = VcdCircuit(args.vcd, timescale_divisor=args.vcd_timescale,
+                           start_cycle=args.vcd_start_cycle, signals=signals,
+                           cache=not args.vcd_no_cache,
+                           keyframe_interval=args.vcd_keyframe_interval,
+                           state_cache_bytes=args.vcd_state_cache_mb * 1024 * 1024,
+                           parse_processes=args.vcd_processes,
+                           follow=args.vcd_follow,
+                           progressive=args.vcd_progressive)
+  elif args.wave:
+    circuit = WaveCircuit(args.wave, timescale_divisor=args.vcd_timescale,
+                          start_cycle=args.vcd_start_cycle)
   else:
-    raise ValueError("Must specify either emulator executable path or VCD file")
+    raise ValueError("Must specify either emulator executable path, VCD file or waveform file")
   
-  vis_descriptor = YamlDescriptor()
-  vis_descriptor.read_descriptor(os.path.dirname(__file__) + "/vislib.yaml")
-  vis_descriptor.read_descriptor(args.visualizer_desc)
-
   ChisualizerManager(vis_descriptor, circuit).run()
 
 if __name__ == "__main__":
@@ -56,6 +56,8 @@ class ChisualizerPanel(wx.Panel):
       self.manager.circuit_back()
     elif char == wx.WXK_DOWN:
       self.manager.circuit_fwd()
+    elif char == wx.WXK_ESCAPE:
+      self.manager.circuit_cancel()
     elif char == ord('s'):
       cur_val = -1
       dlg = wx.TextEntryDialog(None, 'Step', 'Cycles to step', "1")
@@ -192,7 +194,7 @@ class ChisualizerPanel(wx.Panel):
       cr.set_font_size(10)
       cr.move_to(0, height - 15)
       cr.show_text("Cycle %s, render: %.2f ms" %
-                   (self.manager.get_circuit_cycle(), timer_draw*1000))
+                   (self.manager.get_circuit_status(), timer_draw*1000))
       cr.move_to(0, height - 5)
       cr.show_text(u"(\u25B2) back one cycle, (\u25BC) forward one cycle, (s) variable cycle step, (r) cycle in reset, (mousewheel) zoom, (p) save to SVG")
       
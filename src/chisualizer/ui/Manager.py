@@ -5,11 +5,15 @@ import wx
 
 from ChisualizerFrame import ChisualizerFrame
 from TemporalOverview import TemporalOverview
+from chisualizer.circuit.PathRecorder import PathRecorderView
 from chisualizer.visualizers.VisualizerBase import AbstractVisualizer
 from chisualizer.visualizers.Theme import DarkTheme
 
 from chisualizer.util import Rectangle
 
+# Interval at which the circuit is polled for outside changes.
+POLL_INTERVAL_MS = 500
+
 class VisualizerRoot(object):
   """Root of the visualizer descriptor tree."""
   def __init__(self, circuit_view, vis_descriptor):
@@ -46,6 +50,16 @@ class VisualizerRoot(object):
   def get_circuit_node(self):
     return self.node
 
+def get_referenced_paths(vis_descriptor):
+  """Instantiates every display and temporal element of a descriptor against a
+  PathRecorderView, returning the set of circuit paths they reference."""
+  recorder_view = PathRecorderView()
+  elts = (vis_descriptor.get_display_elements().values()
+          + vis_descriptor.get_temporal_elements().values())
+  for elt in elts:
+    VisualizerRoot(recorder_view, elt)
+  return recorder_view.paths
+
 class ChisualizerManager(object):
   def __init__(self, vis_descriptor, circuit):
     self.vis_descriptor = vis_descriptor
@@ -68,6 +82,9 @@ class ChisualizerManager(object):
       vis_root = VisualizerRoot(self.historical_view, elt)
       vis_frame = TemporalOverview(None, self, elt_name, self.historical_view, vis_root)
       self.frames.append(vis_frame)
+
+    self.poll_timer = wx.PyTimer(self.circuit.poll)
+    self.poll_timer.Start(POLL_INTERVAL_MS)
       
     app.MainLoop()
   
@@ -80,6 +97,13 @@ class ChisualizerManager(object):
   
   def get_circuit_cycle(self):
     return self.circuit.get_current_temporal_node().get_label()
+
+  def get_circuit_status(self):
+    """Returns the cycle label, with any circuit status text appended."""
+    status_text = self.circuit.get_status_text()
+    if status_text is None:
+      return self.get_circuit_cycle()
+    return "%s (%s)" % (self.get_circuit_cycle(), status_text)
   
   def circuit_reset(self, cycles=1):
     self.circuit.reset(cycles)
@@ -100,3 +124,6 @@ class ChisualizerManager(object):
   def circuit_back(self):
     self.circuit.navigate_back()
     self.refresh_visualizers()
+
+  def circuit_cancel(self):
+    self.circuit.cancel()
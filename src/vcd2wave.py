@@ -0,0 +1,3 @@
+from chisualizer.circuit.WaveFile import run_converter
+
+run_converter()
@@ -0,0 +1,3 @@
+from chisualizer.circuit.VcdExtract import run_extractor
+
+run_extractor()
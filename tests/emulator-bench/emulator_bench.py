@@ -0,0 +1,294 @@
+"""
+Benchmarks for driving emulators through ChiselEmulatorSubprocess, run
+against the stand-in emulator (fake_emulator.py).
+Run from this directory, like the other tests:
+  python emulator_bench.py --wires 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'src'))
+
+from chisualizer.circuit.ChiselEmulatorSubprocess import ChiselEmulatorSubprocess
+
+FAKE_EMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'fake_emulator.py')
+
+def timed(fn, *args, **kwargs):
+  begin = time.time()
+  result = fn(*args, **kwargs)
+  return time.time() - begin, result
+
+def start_emulator(wires, *emulator_args, **kwargs):
+  return ChiselEmulatorSubprocess([sys.executable, FAKE_EMULATOR,
+                                   '--wires', str(wires)]
+                                  + list(emulator_args), **kwargs)
+
+def bench_peek(wires, steps=10):
+  def unbatched_capture(circuit):
+    return dict((wire, circuit.command('wire_peek', wire))
+                for wire in circuit.wires)
+
+  results = []
+  for label, emulator_args in (('bulk', ()),
+                               ('pipelined', ('--no_bulk_peek',))):
+    circuit = start_emulator(wires, *emulator_args)
+    try:
+      assert circuit.has_bulk_peek == (label == 'bulk')
+      def capture():
+        circuit.invalidate_peeks()  # as after a step
+        return dict(zip(circuit.wires, circuit.peek_wires(circuit.wires)))
+      expected = unbatched_capture(circuit)
+      assert capture() == expected, "%s peeks disagree" % label
+      capture_time, _ = timed(lambda: [capture() for _ in xrange(steps)])
+      if not results:
+        unbatched_time, _ = timed(lambda: [unbatched_capture(circuit)
+                                           for _ in xrange(steps)])
+        results.append(('one by one', unbatched_time))
+      results.append((label, capture_time))
+    finally:
+      circuit.close()
+  print "State capture (%i wires): %s" % (wires, ", ".join(
+      "%s %.1f ms" % (label, capture_time * 1000 / steps)
+      for label, capture_time in results))
+
+def bench_transport(wires, repeats=5):
+  def node_requests(circuit):
+    """Requests of the values and widths of all wires and memory elements."""
+    root = circuit.get_current_view().get_root_node()
+    requests = []
+    for wire in circuit.wires:
+      requests.append(('wire_peek', wire))
+      requests.append(('wire_width', wire))
+    for mem in circuit.mems:
+      for address in xrange(root.get_node_by_path(mem).depth):
+        requests.append(('mem_peek', mem, address))
+    return requests
+  # Uncached, to time the transport alone.
+  def one_by_one(requests):
+    return [circuit.request(*request).get() for request in requests]
+  def pipelined(requests):
+    return [reply.get()
+            for reply in [circuit.request(*request) for request in requests]]
+
+  results = []
+  expected = None
+  for label in ('text', 'binary'):
+    circuit = start_emulator(wires, binary_framing=(label == 'binary'))
+    try:
+      assert circuit.transport.binary == (label == 'binary')
+      requests = node_requests(circuit)
+      if expected is None:
+        expected = one_by_one(requests)
+        one_by_one_time, _ = timed(lambda: [one_by_one(requests)
+                                            for _ in xrange(repeats)])
+        results.append(('one by one', one_by_one_time))
+      assert pipelined(requests) == expected, "%s replies disagree" % label
+      pipelined_time, _ = timed(lambda: [pipelined(requests)
+                                         for _ in xrange(repeats)])
+      results.append(('pipelined, %s replies' % label, pipelined_time))
+    finally:
+      circuit.close()
+  print "Node requests (%i): %s" % (len(requests), ", ".join(
+      "%s %.1f ms" % (label, request_time * 1000 / repeats)
+      for label, request_time in results))
+
+def bench_redraw(wires, nodes=1000, steps=5):
+  """Reads nodes the way a frame redraw does: each value several times (text,
+  colors, modifiers) and each width (layout)."""
+  circuit = start_emulator(wires)
+  try:
+    root = circuit.get_current_view().get_root_node()
+    drawn = [root.get_node_by_path(wire) for wire in circuit.wires[:nodes]]
+    for mem in circuit.mems:
+      mem_node = root.get_node_by_path(mem)
+      drawn.extend(mem_node.get_subscript_reference(address)
+                   for address in xrange(mem_node.depth))
+    def redraw():
+      for node in drawn:
+        for _ in xrange(3):
+          node.get_value()
+        node.get_width()
+    def count_commands(fn):
+      sent_count = circuit.transport.sent_count
+      elapsed, _ = timed(fn)
+      return circuit.transport.sent_count - sent_count, elapsed
+
+    counts = []
+    for _ in xrange(steps):
+      circuit.navigate_fwd()
+      counts.append((count_commands(redraw), count_commands(redraw)))
+    print "Redraw (%i nodes): after a step %i commands, %.1f ms, unchanged %i commands, %.1f ms" % (
+        len(drawn),
+        sum(first[0] for first, _ in counts) / steps,
+        sum(first[1] for first, _ in counts) * 1000 / steps,
+        sum(second[0] for _, second in counts) / steps,
+        sum(second[1] for _, second in counts) * 1000 / steps)
+  finally:
+    circuit.close()
+
+def bench_capture(wires, shown=200, steps=20):
+  """Steps with a historical view showing some wires, against capturing every
+  wire of the design."""
+  results = []
+  for label in ('shown', 'all'):
+    circuit = start_emulator(wires, '--no_bulk_peek')
+    try:
+      root = circuit.get_historical_view().get_root_node()
+      for wire in circuit.wires[:shown] if label == 'shown' else circuit.wires:
+        root.get_child_reference(wire)
+      sent_count = circuit.transport.sent_count
+      step_time, _ = timed(lambda: [circuit.navigate_fwd()
+                                    for _ in xrange(steps)])
+      results.append((label, len(circuit.captured_wires), step_time,
+                      circuit.transport.sent_count - sent_count))
+    finally:
+      circuit.close()
+  print "Step capture (%i wires, pipelined peeks): %s" % (wires, ", ".join(
+      "%s (%i wires) %.1f ms, %i commands" % (
+          label, captured, step_time * 1000 / steps, sent_count / steps)
+      for label, captured, step_time, sent_count in results))
+
+def bench_run(wires, cycles=1000000, cycle_us=2):
+  """Runs many cycles while the UI thread keeps polling and peeking, timing
+  how long the UI thread is held up, then cancels a second run. Peeks go
+  through the cache, which must not keep showing the state before the run."""
+  circuit = start_emulator(wires, '--cycle_us', str(cycle_us))
+  try:
+    wire = circuit.wires[0]
+    start_time, _ = timed(circuit.navigate_fwd, cycles)
+    max_wait = 0
+    peeked = set()
+    run_begin = time.time()
+    while circuit.runner is not None:
+      time.sleep(0.01)
+      wait, value = timed(lambda: circuit.request_peek('wire_peek', wire).get())
+      max_wait = max(max_wait, wait)
+      peeked.add(value)
+      circuit.poll()
+    run_time = time.time() - run_begin
+    assert circuit.get_current_temporal_node().cycle == cycles
+    assert len(peeked) > 1, "cached peeks stale during the run"
+
+    circuit.navigate_fwd(cycles)
+    time.sleep(0.2)
+    cancel_begin = time.time()
+    circuit.cancel()
+    while circuit.runner is not None:
+      time.sleep(0.001)
+      circuit.poll()
+    cancel_time = time.time() - cancel_begin
+    print "Run (%i cycles at %g us): navigate_fwd returned in %.1f ms, ran in %.2f s, UI thread held up to %.1f ms, cancelled in %.1f ms at cycle %i" % (
+        cycles, cycle_us, start_time * 1000, run_time, max_wait * 1000,
+        cancel_time * 1000, circuit.get_current_temporal_node().cycle)
+  finally:
+    circuit.close()
+
+def check_snapshot_poke(wires, poked_value=0x1234):
+  """Pokes a wire, steps past the budget of snapshots, and steps back to the
+  poked node, which must still hold the poke."""
+  circuit = start_emulator(wires, max_snapshots=3)
+  try:
+    wire = circuit.wires[1]  # 32 bits wide
+    for _ in xrange(3):
+      circuit.navigate_fwd()
+    circuit.get_current_view().get_root_node().get_child_reference(
+        wire).set_value(poked_value)
+    for _ in xrange(6):
+      circuit.navigate_fwd()
+    for _ in xrange(6):
+      circuit.navigate_back()
+    assert circuit.get_current_temporal_node().cycle == 3
+    assert circuit.command('wire_peek', wire) == poked_value, \
+        "poke lost to snapshot eviction"
+  finally:
+    circuit.close()
+
+def bench_snapshots(wires, steps=5000, max_snapshots=64, shown=20):
+  """Steps through a long session with a snapshot budget (poking a wire
+  early on), then steps all the way back, checking each node's state
+  against the values captured going forward."""
+  check_snapshot_poke(wires)
+  circuit = start_emulator(wires, max_snapshots=max_snapshots)
+  try:
+    root = circuit.get_historical_view().get_root_node()
+    for wire in circuit.wires[:shown]:
+      root.get_child_reference(wire)
+    def step_fwd():
+      for step in xrange(steps):
+        if step == 3:
+          circuit.get_current_view().get_root_node().get_child_reference(
+              circuit.wires[1]).set_value(0x1234)
+        circuit.navigate_fwd()
+    fwd_time, _ = timed(step_fwd)
+    snapshot_count = int(circuit.command('snapshot_count'))
+    def step_back():
+      max_step = 0
+      while circuit.get_current_temporal_node().get_prev_time() is not None:
+        step_time, _ = timed(circuit.navigate_back)
+        max_step = max(max_step, step_time)
+        node = circuit.get_current_temporal_node()
+        assert node.value_dict == circuit.current_to_value_dict(), \
+            "state at cycle %i differs" % node.cycle
+      return max_step
+    sent_count = circuit.transport.sent_count
+    back_time, max_step = timed(step_back)
+    print "Snapshots (%i steps, budget %i): forward %.2f ms/step with %i snapshots in the emulator, back %.2f ms/step (at most %.1f ms, %i commands/step), %i evicted" % (
+        steps, max_snapshots, fwd_time * 1000 / steps, snapshot_count,
+        back_time * 1000 / steps, max_step * 1000,
+        (circuit.transport.sent_count - sent_count) / steps,
+        circuit.snapshots.evicted_count)
+  finally:
+    circuit.close()
+
+def bench_timeline(wires, sizes=(1000, 20000), jumps=20):
+  """Jumps between the ends of timelines of several lengths, which takes
+  about as long at any length."""
+  results = []
+  for size in sizes:
+    circuit = start_emulator(wires)
+    try:
+      for _ in xrange(size):
+        circuit.navigate_fwd()
+      def jump():
+        circuit.navigate_to_cycle(0)
+        assert circuit.get_current_temporal_node().cycle == 0
+        circuit.navigate_to_cycle(size)
+        assert circuit.get_current_temporal_node().cycle == size
+      jump_time, _ = timed(lambda: [jump() for _ in xrange(jumps)])
+      timeline = circuit.get_current_temporal_node().timeline
+      assert len(timeline.nodes) == size + 1
+      find_time, _ = timed(lambda: [timeline.find(cycle)
+                                    for cycle in xrange(size)])
+      results.append((size, jump_time * 1000 / (jumps * 2),
+                      find_time * 1e6 / size))
+    finally:
+      circuit.close()
+  print "Timeline: %s" % ", ".join(
+      "%i nodes: jump %.2f ms (lookup %.1f us)" % result for result in results)
+
+BENCHMARKS = {
+  'capture': bench_capture,
+  'run': bench_run,
+  'snapshots': bench_snapshots,
+  'timeline': bench_timeline,
+  'peek': bench_peek,
+  'transport': bench_transport,
+  'redraw': bench_redraw,
+}
+
+def main():
+  parser = argparse.ArgumentParser(description="Emulator driving benchmarks")
+  parser.add_argument('--wires', type=int, default=2000)
+  parser.add_argument('--bench', nargs='*', choices=sorted(BENCHMARKS.keys()),
+                      default=sorted(BENCHMARKS.keys()),
+                      help="Benchmarks to run (default: all).")
+  args = parser.parse_args()
+  for bench_name in args.bench:
+    BENCHMARKS[bench_name](args.wires)
+
+if __name__ == "__main__":
+  main()
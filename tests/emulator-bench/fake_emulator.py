@@ -0,0 +1,151 @@
+"""
+Stand-in for a Chisel API compliant emulator, speaking the line protocol
+ChiselEmulatorSubprocess drives, over a generated circuit whose wire values
+are a function of the cycle (and of any pokes). Used by the emulator
+benchmarks, and usable as a --emulator for the visualizer:
+  python fake_emulator.py --wires 20000
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'src'))
+
+from chisualizer.circuit.EmulatorTransport import FRAME_ERROR, FRAME_HEADER, FRAME_OK, encode_uint, encode_uints
+
+def wire_name(index, scope_size=256):
+  return "Top.mod%i.sig%i" % (index // scope_size, index)
+
+class FakeEmulator(object):
+  def __init__(self, wires, mems, mem_depth, bulk_peek=True,
+               binary_framing=True, cycle_seconds=0, snapshot_release=True):
+    self.wires = [wire_name(i) for i in xrange(wires)]
+    self.widths = dict((wire, 1 if i % 4 == 0 else 32)
+                       for i, wire in enumerate(self.wires))
+    self.mems = ["Top.mem%i" % i for i in xrange(mems)]
+    self.mem_depth = mem_depth
+    self.bulk_peek = bulk_peek
+    self.binary_framing = binary_framing
+    self.binary = False  # whether replies are framed
+    self.cycle_seconds = cycle_seconds  # simulation time per cycle
+    self.snapshot_release = snapshot_release
+    self.cycle = 0
+    self.pokes = {}  # map from wire or (mem, address) to poked value
+    self.snapshots = {}  # map from name to (cycle, pokes)
+
+  def peek(self, key):
+    if key in self.pokes:
+      return self.pokes[key]
+    return hash((key, self.cycle)) & 0xffffffff
+
+  def wire_peek(self, wire):
+    if wire not in self.widths:
+      raise KeyError(wire)
+    return self.peek(wire) & ((1 << self.widths[wire]) - 1)
+
+  def execute(self, op, args):
+    """Returns the reply to a command, as a string, or an int or list of
+    ints for peeks."""
+    if op == 'list_wires':
+      return ' '.join(self.wires)
+    elif op == 'list_mems':
+      return ' '.join(self.mems)
+    elif op == 'wire_peek':
+      return self.wire_peek(args[0])
+    elif op == 'wire_peek_bulk' and self.bulk_peek:
+      return [self.wire_peek(wire) for wire in args]
+    elif op == 'wire_width':
+      return str(self.widths[args[0]])
+    elif op == 'wire_poke':
+      self.pokes[args[0]] = int(args[1], 0)
+      return 'ok'
+    elif op == 'mem_width':
+      return '32'
+    elif op == 'mem_depth':
+      return str(self.mem_depth)
+    elif op == 'mem_peek':
+      return self.peek((args[0], int(args[1])))
+    elif op == 'mem_poke':
+      self.pokes[(args[0], int(args[1]))] = int(args[2], 0)
+      return 'ok'
+    elif op == 'propagate':
+      return 'ok'
+    elif op in ('reset', 'clock'):
+      cycles = int(args[0])
+      time.sleep(cycles * self.cycle_seconds)
+      self.cycle += cycles
+      self.pokes = {}
+      return str(cycles)
+    elif op == 'referenced_snapshot_save':
+      self.snapshots[args[0]] = (self.cycle, dict(self.pokes))
+      return 'ok'
+    elif op == 'referenced_snapshot_restore':
+      self.cycle, pokes = self.snapshots[args[0]]
+      self.pokes = dict(pokes)
+      return 'ok'
+    elif op == 'referenced_snapshot_release' and self.snapshot_release:
+      del self.snapshots[args[0]]
+      return 'ok'
+    elif op == 'snapshot_count':  # not in the API, for the benchmarks
+      return str(len(self.snapshots))
+    elif op == 'binary_framing' and self.binary_framing:
+      return 'ok'
+    raise KeyError(op)
+
+  def run(self, fin, fout):
+    for line in iter(fin.readline, ''):
+      tokens = line.split()
+      if not tokens:
+        continue
+      if tokens[0] == 'quit':
+        break
+      try:
+        result = self.execute(tokens[0], tokens[1:])
+        status = FRAME_OK
+      except (KeyError, IndexError, ValueError) as e:
+        result = "error: %s" % e
+        status = FRAME_ERROR
+      if self.binary:
+        if isinstance(result, list):
+          out = encode_uints(result)
+        elif isinstance(result, (int, long)):
+          out = encode_uint(result)
+        else:
+          out = result
+        fout.write(struct.pack(FRAME_HEADER, status, len(out)) + out)
+      else:
+        if isinstance(result, list):
+          out = ' '.join('0x%x' % value for value in result)
+        elif isinstance(result, (int, long)):
+          out = '0x%x' % result
+        else:
+          out = result
+        fout.write(out + '\n')
+      fout.flush()
+      if tokens[0] == 'binary_framing' and status == FRAME_OK:
+        self.binary = True
+
+def main():
+  parser = argparse.ArgumentParser(description="Stand-in Chisel emulator")
+  parser.add_argument('--wires', type=int, default=2000)
+  parser.add_argument('--mems', type=int, default=4)
+  parser.add_argument('--mem_depth', type=int, default=32)
+  parser.add_argument('--no_bulk_peek', action='store_true',
+                      help="Reply to wire_peek_bulk with an error, like emulators without it.")
+  parser.add_argument('--no_binary_framing', action='store_true',
+                      help="Reply to binary_framing with an error, like emulators without it.")
+  parser.add_argument('--cycle_us', type=float, default=0,
+                      help="Microseconds each clocked cycle takes to simulate.")
+  parser.add_argument('--no_snapshot_release', action='store_true',
+                      help="Reply to referenced_snapshot_release with an error, like emulators without it.")
+  args = parser.parse_args()
+  FakeEmulator(args.wires, args.mems, args.mem_depth, not args.no_bulk_peek,
+               not args.no_binary_framing,
+               args.cycle_us / 1e6,
+               not args.no_snapshot_release).run(sys.stdin, sys.stdout)
+
+if __name__ == "__main__":
+  main()
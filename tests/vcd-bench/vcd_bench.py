@@ -0,0 +1,248 @@
+"""
+Throughput benchmarks for the VCD ingestion path, run on generated dumps.
+Run from this directory, like the other tests:
+  python vcd_bench.py --signals 2000 --cycles 20000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'src'))
+
+from chisualizer.circuit.Verilog_VCD.Verilog_VCD import parse_vcd as parse_vcd_legacy
+from chisualizer.circuit.VcdCache import cache_filename, load_vcd_cache, save_vcd_cache
+from chisualizer.circuit.VcdCircuit import VcdCircuit, build_vcd_tables
+from chisualizer.circuit.VcdHistory import VcdHistory
+from chisualizer.circuit.ValueDictView import ValueDictView
+from chisualizer.circuit.VcdParser import parse_vcd
+from chisualizer.circuit.VcdWindowedCircuit import VcdWindowedCircuit
+from chisualizer.circuit.WaveCircuit import WaveCircuit
+from chisualizer.circuit.WaveFile import convert_vcd
+
+def vcd_code(index):
+  """Returns the VCD identifier code for a signal index."""
+  code = ''
+  index += 1
+  while index > 0:
+    index -= 1
+    code += chr(33 + index % 94)
+    index //= 94
+  return code
+
+def generate_vcd(filename, signals, cycles, toggle_rate=0.1, seed=0):
+  """Writes a dump with a mix of scalar, vector, per-bit (ModelSim style)
+  and memory element nets, where each net changes with probability
+  toggle_rate per cycle."""
+  rand = random.Random(seed)
+  nets = []  # (code, width)
+  f = open(filename, 'w')
+  f.write("$timescale 1ps $end\n")
+  f.write("$scope module top $end\n")
+  scope_size = 256
+  for i in xrange(signals):
+    if i % scope_size == 0:
+      if i > 0:
+        f.write("$upscope $end\n")
+      f.write("$scope module mod%i $end\n" % (i // scope_size))
+    code = vcd_code(i)
+    kind = i % 4
+    if kind == 0:
+      width = 1
+      f.write("$var wire 1 %s sig%i $end\n" % (code, i))
+    elif kind == 1:
+      width = 32
+      f.write("$var wire 32 %s sig%i [31:0] $end\n" % (code, i))
+    elif kind == 2:
+      # single bit of a split bus, grouped into 8 bit bundles
+      width = 1
+      f.write("$var wire 1 %s bus%i [%i] $end\n" % (code, i // 32, (i // 4) % 8))
+    else:
+      width = 16
+      f.write("$var wire 16 %s mem%i [%i] $end\n" % (code, i // 256, (i // 4) % 64))
+    nets.append((code, width))
+  f.write("$upscope $end\n")
+  f.write("$upscope $end\n")
+  f.write("$enddefinitions $end\n")
+
+  def value_str(code, width):
+    if width == 1:
+      return "%s%s\n" % (rand.choice('01'), code)
+    return "b%s %s\n" % (bin(rand.getrandbits(width))[2:], code)
+
+  f.write("#0\n$dumpvars\n")
+  for code, width in nets:
+    f.write(value_str(code, width))
+  f.write("$end\n")
+  for cycle in xrange(1, cycles):
+    f.write("#%i\n" % cycle)
+    for code, width in nets:
+      if rand.random() < toggle_rate:
+        f.write(value_str(code, width))
+  f.close()
+
+def timed(fn, *args, **kwargs):
+  begin = time.time()
+  result = fn(*args, **kwargs)
+  return time.time() - begin, result
+
+def decode_legacy_result(parsed_vcd):
+  """Converts a Verilog_VCD.parse_vcd result into the VcdParser format."""
+  decoded = {}
+  for vcd_key, nets_tv_dict in parsed_vcd.iteritems():
+    size = max(int(net_dict['size'], 10) for net_dict in nets_tv_dict['nets'])
+    decoded[vcd_key] = {
+      'nets': nets_tv_dict['nets'],
+      'history': VcdHistory.from_tv_list(nets_tv_dict.get('tv', []), size),
+    }
+  return decoded
+
+def bench_parse(filename):
+  size_mb = os.path.getsize(filename) / 1e6
+  legacy_time, legacy_result = timed(parse_vcd_legacy, filename)
+  new_time, new_result = timed(parse_vcd, filename)
+  assert decode_legacy_result(legacy_result) == new_result, "parsers disagree"
+  print "Verilog_VCD.parse_vcd: %.2f s, %.1f MB/s" % (legacy_time, size_mb / legacy_time)
+  print "VcdParser.parse_vcd:   %.2f s, %.1f MB/s (%.1fx)" % (new_time, size_mb / new_time,
+                                                           legacy_time / new_time)
+  processes = multiprocessing.cpu_count()
+  if processes > 1:
+    parallel_time, parallel_result = timed(parse_vcd, filename, processes=processes)
+    assert parallel_result == new_result, "parallel parse disagrees"
+    print "  with %i processes:   %.2f s, %.1f MB/s (%.1fx)" % (
+        processes, parallel_time, size_mb / parallel_time, legacy_time / parallel_time)
+
+def bench_cache(filename):
+  parse_time, tables = timed(lambda: build_vcd_tables(parse_vcd(filename)))
+  save_time, _ = timed(save_vcd_cache, filename, None, tables)
+  load_time, cached_tables = timed(load_vcd_cache, filename)
+  os.remove(cache_filename(filename))
+  assert cached_tables == tables, "cache contents differ"
+  print "Parse: %.2f s, cache write: %.2f s, cache load: %.2f s (%.1fx)" % (
+      parse_time, save_time, load_time, parse_time / load_time)
+
+def vcd_node_next(cycle, curr_idx, node):
+  """Linear seek of a node's history, as VcdCircuit stepped before binary
+  search."""
+  times = node.history.times
+  while curr_idx < len(times) - 1:
+    if times[curr_idx+1] > cycle:
+      break
+    curr_idx += 1
+  assert curr_idx == len(times) - 1 or times[curr_idx+1] > cycle
+  return curr_idx, node.history.values[curr_idx]
+
+def bench_seek(filename, seeks=20):
+  circuit = VcdCircuit(filename, cache=False)
+  last_cycle = max(node.history.times[-1] for node in circuit.nodes.itervalues())
+  rand = random.Random(0)
+  cycles = [rand.randint(0, last_cycle) for _ in xrange(seeks)]
+
+  def linear_seeks():
+    for cycle in cycles:
+      for vcd_node in circuit.nodes.itervalues():
+        vcd_node_next(cycle, 0, vcd_node)
+  def binary_seeks():
+    for cycle in cycles:
+      circuit.seek_temporal_state(cycle)
+  def keyframe_seeks():
+    for cycle in cycles:
+      circuit.create_temporal_node(cycle)
+
+  linear_time, _ = timed(linear_seeks)
+  binary_time, _ = timed(binary_seeks)
+  keyframe_time, _ = timed(keyframe_seeks)
+  print "Seek (%i random cycles): linear %.1f ms, binary search %.1f ms, keyframes (every %i) %.1f ms per seek" % (
+      seeks, linear_time * 1000 / seeks, binary_time * 1000 / seeks,
+      circuit.keyframe_interval, keyframe_time * 1000 / seeks)
+
+def bench_step(filename, steps=500):
+  circuit = VcdCircuit(filename, cache=False)
+  step_time, _ = timed(lambda: [circuit.navigate_fwd() for _ in xrange(steps)])
+  print "Step (%i cycles): %.2f ms per cycle" % (steps, step_time * 1000 / steps)
+
+def bench_lazy(filename, seeks=5):
+  full_time, full_circuit = timed(VcdCircuit, filename, cache=False)
+  last_cycle = max(node.history.times[-1]
+                   for node in full_circuit.nodes.itervalues())
+  del full_circuit
+  lazy_time, circuit = timed(VcdWindowedCircuit, filename)
+  rand = random.Random(0)
+  cycles = [rand.randint(0, last_cycle) for _ in xrange(seeks)]
+  seek_time, _ = timed(lambda: [circuit.get_state(cycle) for cycle in cycles])
+  print "Startup: full %.2f s, lazy %.2f s (%.1fx), lazy seek (%i random cycles) %.0f ms per seek" % (
+      full_time, lazy_time, full_time / lazy_time, seeks, seek_time * 1000 / seeks)
+
+def view_values(circuit, state):
+  """Returns the map from node path to value of a state, read through a view
+  like the visualizer does (states may hold memories whole)."""
+  view = ValueDictView(circuit, circuit.width_dict, circuit.memory_depths)
+  view.set_view(state)
+  return dict((path, view.get_value(path)) for path in circuit.width_dict
+              if view.has_value(path))
+
+def bench_wave(filename, seeks=20):
+  full_time, full_circuit = timed(VcdCircuit, filename, cache=False)
+  last_cycle = max(node.history.times[-1]
+                   for node in full_circuit.nodes.itervalues())
+  convert_time, wave_filename = timed(convert_vcd, filename,
+                                      filename + '.chwave')
+  try:
+    open_time, circuit = timed(WaveCircuit, wave_filename)
+    rand = random.Random(0)
+    cycles = [rand.randint(0, last_cycle) for _ in xrange(seeks)]
+    for cycle in cycles:
+      assert view_values(circuit, circuit.get_state(cycle)) == view_values(
+          full_circuit,
+          full_circuit.create_temporal_node(cycle).get_historical_state()), \
+          "waveform file disagrees"
+    seek_time, _ = timed(lambda: [circuit.get_state(cycle) for cycle in cycles])
+    print "Waveform: %.1f MB, convert %.2f s, open %.3f s (full VCD load %.2f s), seek (%i random cycles) %.1f ms per seek" % (
+        os.path.getsize(wave_filename) / 1e6, convert_time, open_time,
+        full_time, seeks, seek_time * 1000 / seeks)
+  finally:
+    os.remove(wave_filename)
+
+BENCHMARKS = {
+  'parse': bench_parse,
+  'cache': bench_cache,
+  'seek': bench_seek,
+  'step': bench_step,
+  'lazy': bench_lazy,
+  'wave': bench_wave,
+}
+
+def main():
+  parser = argparse.ArgumentParser(description="VCD ingestion benchmarks")
+  parser.add_argument('--signals', type=int, default=2000)
+  parser.add_argument('--cycles', type=int, default=20000)
+  parser.add_argument('--toggle_rate', type=float, default=0.1)
+  parser.add_argument('--vcd',
+                      help="Benchmark against an existing dump instead of a generated one.")
+  parser.add_argument('--bench', nargs='*', choices=sorted(BENCHMARKS.keys()),
+                      default=sorted(BENCHMARKS.keys()),
+                      help="Benchmarks to run (default: all).")
+  args = parser.parse_args()
+
+  if args.vcd:
+    filename = args.vcd
+  else:
+    fd, filename = tempfile.mkstemp(suffix='.vcd')
+    os.close(fd)
+    print "Generating %i signals x %i cycles..." % (args.signals, args.cycles)
+    generate_vcd(filename, args.signals, args.cycles, args.toggle_rate)
+  print "Dump: %s (%.1f MB)" % (filename, os.path.getsize(filename) / 1e6)
+
+  try:
+    for bench_name in args.bench:
+      BENCHMARKS[bench_name](filename)
+  finally:
+    if not args.vcd:
+      os.remove(filename)
+
+if __name__ == "__main__":
+  main()